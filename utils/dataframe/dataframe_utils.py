@@ -1,16 +1,22 @@
 import os.path
 import re
+import sys
+import time
 import pandas as pd
 import numpy as np
 import json
 import logging
 from collections import OrderedDict
-from utils.regex.apply import check_compile_regex
+try:
+    from re import _parser as sre_parser
+except ImportError:
+    import sre_parse as sre_parser
+from utils.regex.apply import check_compile_regex, get_pattern_matches_iter, get_group_titles
+from utils.regex.engine import get_pattern_engine
 from utils.debug_utils import print_file_function
-from utils.text.lines import get_multiline_post_para_offsets, get_matches_with_group_relative_offsets,\
-    combine_matches_with_post_groups, print_matches_with_post_groups, \
-    extend_match_groups_with_post_groups, set_groups_absolute_offset
-from utils.regex.apply import regex_apply_on_text
+from utils.text.lines import get_matches_with_extended_groups_absolute, get_combined_matches_with_post_groups
+from utils.regex.apply import regex_apply_on_text, regex_pattern_iter_on_text
+from utils.regex.mapped import check_compile_file_regex, regex_pattern_iter_on_file
 
 
 logger = logging.getLogger(__name__)
@@ -24,48 +30,256 @@ def df_new_dataframe():
     return pd.DataFrame()
 
 
-def create_df_from_text_using_regex(regex_text, input_file_text, flags=None):
-    p, error = check_compile_regex(regex_text, flags=flags)
+# The column titles of pd.Series.str.extractall(): the group name, else the group index from 0
+def get_extract_columns(extract_pattern):
+    reverse_group_dict = {index: name for name, index in extract_pattern.groupindex.items()}
+    return [reverse_group_dict.get(index, index - 1) for index in range(1, extract_pattern.groups + 1)]
 
-    if error:
-        logger.error("Regex has errors: ", error)
+
+# The frame of pd.Series.str.extractall() on the text from the values of each group. The unmatched and the empty
+# groups are NaN.
+def create_extract_frame(extract_pattern, columns_values, text):
+    dtype = pd.Series([text]).dtype
+
+    data = OrderedDict()
+    for column, values in zip(get_extract_columns(extract_pattern), columns_values):
+        data[column] = pd.Series([value if value else np.nan for value in values], dtype=dtype)
+
+    df = pd.DataFrame(data)
+    # As extractall gives the frame without matches
+    if len(df) == 0:
+        df.index = pd.Index([], dtype=object)
+    df.index.name = "match"
+    return df
+
+
+# The (start, end) of the groups of a fixed width line pattern e.g. ^(?P<Date>.{9}).{2}(?P<Amount>.{10})$ along with
+# the width of the pattern, and whether the lines must be of the width i.e. the pattern ends with $.
+# None if the pattern is not such a pattern. The pattern must be multiline as the extraction patterns are.
+def get_fixed_width_fields(extract_pattern):
+    if not isinstance(extract_pattern, re.Pattern) or not isinstance(extract_pattern.pattern, str):
+        return None
+
+    if not extract_pattern.flags & re.MULTILINE or extract_pattern.flags & re.DOTALL:
         return None
 
-    s = pd.Series(input_file_text)
     try:
-        df = s.str.extractall(regex_text , re.MULTILINE)
-    except ValueError as e:
-        logger.error(e)
+        items = list(sre_parser.parse(extract_pattern.pattern, extract_pattern.flags))
+    except re.error:
+        return None
+
+    if not items or items[0] != (sre_parser.AT, sre_parser.AT_BEGINNING):
+        return None
+    items = items[1:]
+
+    exact_width = bool(items) and items[-1] == (sre_parser.AT, sre_parser.AT_END)
+    if exact_width:
+        items = items[:-1]
+
+    fields = []
+    width = 0
+    for op, av in items:
+        if op is sre_parser.SUBPATTERN:
+            group, add_flags, del_flags, sub_items = av
+            if add_flags or del_flags:
+                return None
+
+            item_width = get_any_width(list(sub_items))
+            if item_width is None:
+                return None
+
+            if group is not None:
+                fields.append((width, width + item_width))
+        else:
+            item_width = get_any_width([(op, av)])
+            if item_width is None:
+                return None
+
+        width += item_width
+
+    if width == 0 or len(fields) != extract_pattern.groups:
+        return None
+
+    return fields, width, exact_width
+
+
+# The width of parsed pattern items made of . and .{n} only, else None
+def get_any_width(items):
+    width = 0
+    for op, av in items:
+        if op is sre_parser.ANY:
+            width += 1
+        elif op in (sre_parser.MAX_REPEAT, sre_parser.MIN_REPEAT) and av[0] == av[1] and \
+                list(av[2]) == [(sre_parser.ANY, None)]:
+            width += av[0]
+        else:
+            return None
+
+    return width
+
+
+def extract_using_extractall(extract_pattern, text):
+    s = pd.Series(text)
+    df = s.str.extractall(extract_pattern)
 
-    # Verify for later:
     # Drop level 0 as we are using the whole string and the level was create as we converted string to pd.Series
-    df = df.droplevel(0)
+    return df.droplevel(0)
 
-    return df
 
+def extract_using_finditer_columnar(extract_pattern, text):
+    rows = [m.groups() for m in get_pattern_matches_iter(extract_pattern, text)]
+    columns_values = list(zip(*rows)) if rows else [() for _ in range(extract_pattern.groups)]
+    return create_extract_frame(extract_pattern, columns_values, text)
 
-def create_dataframe_from_matches(matches):
-    records = []
-    for m_idx, m in enumerate(matches):
-        rec = OrderedDict()
-        for g_idx, g in enumerate(m['groups']):
-            rec[g[3]] = g[0]
-        records.append(rec)
 
-    df = pd.DataFrame(records)
-    return df
+# The lines are sliced at the group columns, the regex is not run
+def extract_using_fixed_width(extract_pattern, text):
+    fixed_width_fields = get_fixed_width_fields(extract_pattern)
+    if fixed_width_fields is None:
+        raise RuntimeError("pattern is not a fixed width pattern: {}".format(extract_pattern.pattern))
 
+    fields, width, exact_width = fixed_width_fields
+    if exact_width:
+        lines = [line for line in text.split("\n") if len(line) == width]
+    else:
+        lines = [line for line in text.split("\n") if len(line) >= width]
 
-def create_dataframe_from_combined_matches(matches):
-    records = []
-    for m_idx, m in enumerate(matches):
-        rec = OrderedDict()
-        for g_idx, g in enumerate(m['groups']):
-            rec[g['name']] = g['text']
-        records.append(rec)
+    columns_values = [[line[field_start:field_end] for line in lines] for field_start, field_end in fields]
+    return create_extract_frame(extract_pattern, columns_values, text)
 
-    df = pd.DataFrame(records)
-    return df
+
+# The backends give the same frame as pd.Series.str.extractall()
+EXTRACTION_BACKENDS = {
+    "extractall": extract_using_extractall,
+    "finditer-columnar": extract_using_finditer_columnar,
+    "fixed-width": extract_using_fixed_width,
+}
+
+
+# The fixed width patterns are sliced. The other patterns use the finditer-columnar backend, which is faster than
+# extractall on the contract notes (see utils.regex.benchmark.benchmark_extraction_backends()) and is the only
+# backend for the engines other than re.
+def get_extraction_backend(extract_pattern):
+    if get_fixed_width_fields(extract_pattern) is not None:
+        return "fixed-width"
+
+    return "finditer-columnar"
+
+
+# The extraction entry point. The frame is that of pd.Series.str.extractall() on the text, the extraction is
+# always multiline. The backend is one of EXTRACTION_BACKENDS or 'auto'.
+# A regex with errors or without capture groups is logged and gives an empty frame.
+def extract_dataframe_from_text(regex_text, input_file_text, flags=None, backend="auto", engine=None):
+    p, error = check_compile_regex(regex_text, flags=flags, engine=engine)
+
+    if error:
+        logger.error("Regex has errors: {}".format(error))
+        return df_new_dataframe()
+
+    # The compiled pattern comes from the cache
+    extract_pattern, _ = check_compile_regex(regex_text, flags={"multiline": True}, engine=engine)
+
+    if extract_pattern.groups == 0:
+        logger.error("pattern contains no capture groups")
+        return df_new_dataframe()
+
+    if backend == "auto":
+        backend = get_extraction_backend(extract_pattern)
+
+    if backend not in EXTRACTION_BACKENDS:
+        raise RuntimeError("backend '{}' not supported, supported backends are {}".format(
+            backend, list(EXTRACTION_BACKENDS.keys())))
+
+    if backend == "extractall" and get_pattern_engine(regex_text, engine=engine) != 're':
+        raise RuntimeError("backend 'extractall' supports only the 're' engine")
+
+    return EXTRACTION_BACKENDS[backend](extract_pattern, input_file_text)
+
+
+def create_df_from_text_using_regex(regex_text, input_file_text, flags=None, engine=None, backend="extractall"):
+    # pandas cannot use the patterns of the other engines
+    if backend == "extractall" and get_pattern_engine(regex_text, engine=engine) != 're':
+        backend = "finditer-columnar"
+
+    return extract_dataframe_from_text(regex_text, input_file_text, flags=flags, backend=backend, engine=engine)
+
+
+# The pandas string dtype of the columns: 'arrow' for the pyarrow backed strings where pyarrow is installed,
+# 'python' for the python backed strings. None keeps the pandas inference.
+def get_string_dtype(string_dtype=None):
+    if string_dtype is None:
+        return None
+
+    if string_dtype == 'arrow':
+        try:
+            import pyarrow
+            return pd.StringDtype("pyarrow")
+        except ImportError:
+            string_dtype = 'python'
+
+    if string_dtype == 'python':
+        return pd.StringDtype("python")
+
+    raise RuntimeError("string_dtype '{}' not supported".format(string_dtype))
+
+
+# The frame is built column wise from the rows of values which share the titles, the column order is that of
+# the titles. The dtypes are optional dtype hints per column title, the other columns have the string_dtype.
+def create_dataframe_from_rows(titles, rows, dtypes=None, string_dtype=None):
+    if not isinstance(rows, list):
+        rows = list(rows)
+
+    columns = list(zip(*rows)) if rows else [() for _ in titles]
+    column_string_dtype = get_string_dtype(string_dtype)
+
+    data = OrderedDict()
+    for title, values in zip(titles, columns):
+        dtype = dtypes.get(title) if dtypes is not None else None
+        if dtype is None:
+            dtype = column_string_dtype
+        # The empty columns of the frame without rows are not taken as float
+        if dtype is None and not rows:
+            dtype = object
+
+        values = list(values)
+        data[title] = pd.Series(values, dtype=dtype) if dtype is not None else values
+
+    return pd.DataFrame(data, index=pd.RangeIndex(len(rows)))
+
+
+# The frame of the matches of the pattern straight from the matches, without the match objects of
+# regex_pattern_apply_on_text(). The columns are the group titles i.e. the group name, else the group index.
+def create_dataframe_from_pattern(regex_pattern, text, pos=0, endpos=None, dtypes=None, string_dtype=None):
+    rows = [m.groups() for m in get_pattern_matches_iter(regex_pattern, text, pos, endpos)]
+    return create_dataframe_from_rows(get_group_titles(regex_pattern), rows, dtypes=dtypes, string_dtype=string_dtype)
+
+
+def create_dataframe_from_matches(matches, dtypes=None, string_dtype=None):
+    titles = None
+    rows = []
+    for m in matches:
+        if titles is None:
+            titles = [g[3] for g in m['groups']]
+        rows.append([g[0] for g in m['groups']])
+
+    if titles is None:
+        return pd.DataFrame()
+
+    return create_dataframe_from_rows(titles, rows, dtypes=dtypes, string_dtype=string_dtype)
+
+
+def create_dataframe_from_combined_matches(matches, dtypes=None, string_dtype=None):
+    titles = None
+    rows = []
+    for m in matches:
+        if titles is None:
+            titles = [g['name'] for g in m['groups']]
+        rows.append([g['text'] for g in m['groups']])
+
+    if titles is None:
+        return pd.DataFrame()
+
+    return create_dataframe_from_rows(titles, rows, dtypes=dtypes, string_dtype=string_dtype)
 
 
 # We do not use pandas series for dataframe extraction. This gives us more control.
@@ -74,54 +288,47 @@ def create_dataframe_from_text(regex_str, input_str, flags={"multiline": True},
                                extrapolate=False,
                                shadow_join_str="\n",
                                shadow_trim=False,
+                               dtypes=None,
+                               string_dtype=None,
                                debug=False):
-    result = regex_apply_on_text(regex_str, input_str, flags=flags)
-    matches = result['matches']
-
-    if debug:
-        print("First Pass: matches")
-        for m in matches:
-            print(m)
-
     if not extrapolate:
-        df = create_dataframe_from_matches(matches)
-    else:
-        # TBD: The processor will work only if the Tokens are supported
-        extrapolate_new_approach = False
-
-        if not extrapolate_new_approach:
-            multiline_matches = get_multiline_post_para_offsets(matches, len(input_str))
+        # The frame is built straight from the matches, without the match objects
+        pattern, regex_error = check_compile_regex(regex_str, flags=flags)
 
+        if regex_error is None:
             if debug:
-                print("Matches with post para")
-                for m in multiline_matches:
+                print("First Pass: matches")
+                for m in regex_pattern_iter_on_text(pattern, input_str):
                     print(m)
 
-            matches_with_post_groups = get_matches_with_group_relative_offsets(input_str, multiline_matches)
-
-            if debug:
-                print("Matches with post groups")
-                print_matches_with_post_groups(matches_with_post_groups)
+            df = create_dataframe_from_pattern(pattern, input_str, dtypes=dtypes, string_dtype=string_dtype)
+        else:
+            logger.error("Regex has errors: {}".format(regex_error))
+            df = pd.DataFrame()
+    else:
+        result = regex_apply_on_text(regex_str, input_str, flags=flags)
+        matches = result['matches']
 
-            # The extended groups are good for display for they loose the information required for combining
-            matches_with_extended_groups = extend_match_groups_with_post_groups(matches_with_post_groups)
+        if debug:
+            print("First Pass: matches")
+            for m in matches:
+                print(m)
 
-            if debug:
-                print("Matches with Extended Groups:")
-                for m in multiline_matches:
-                    print(m)
+        # TBD: The processor will work only if the Tokens are supported
+        extrapolate_new_approach = False
 
-            matches_with_absolute_offsets = set_groups_absolute_offset(matches_with_extended_groups)
+        if not extrapolate_new_approach:
             if debug:
                 print("Matches with Absolute Offset in Groups:")
-                for m in multiline_matches:
+                for m in get_matches_with_extended_groups_absolute(input_str, matches):
                     print(m)
 
-            combined_matches = combine_matches_with_post_groups(matches_with_post_groups,
-                                                                join_str=shadow_join_str,
-                                                                shadow_trim=shadow_trim,
-                                                                debug=False)
-            df = create_dataframe_from_combined_matches(combined_matches)
+            # Single pass over the matches and their post paras
+            combined_matches = get_combined_matches_with_post_groups(input_str, matches,
+                                                                     join_str=shadow_join_str,
+                                                                     shadow_trim=shadow_trim,
+                                                                     debug=False)
+            df = create_dataframe_from_combined_matches(combined_matches, dtypes=dtypes, string_dtype=string_dtype)
         else:
             # TBD: Need to create generate_token_sequence_from_regex function
 
@@ -139,7 +346,25 @@ def create_dataframe_from_text(regex_str, input_str, flags={"multiline": True},
             match_objects = regex_processor.frame_objects
             df = pd.DataFrame(match_objects)
 
-    if debug or True:
+    if debug:
+        df_print(df)
+
+    return df
+
+
+# File version of create_dataframe_from_text() without extrapolation. The file is memory mapped and the matches
+# are turned into records as they are found, the text is never read into memory as a whole.
+# A regex with errors gives an empty frame, as with create_dataframe_from_text()
+def create_dataframe_from_file(regex_str, file_path, flags={"multiline": True}, encoding="utf-8", debug=False):
+    pattern, regex_error = check_compile_file_regex(regex_str, flags=flags, encoding=encoding)
+
+    if regex_error is None:
+        df = create_dataframe_from_matches(regex_pattern_iter_on_file(pattern, file_path))
+    else:
+        logger.error("Regex has errors: {}".format(regex_error))
+        df = pd.DataFrame()
+
+    if debug:
         df_print(df)
 
     return df
@@ -179,7 +404,105 @@ def df_merge_on_index(df1, df2, columns=[]):
     return df_merged
 
 
-def df_apply_regexlist_on_column(df, regex_list, column=None, new_anchor_column=None, remove=True, multiple=False, join_original=True, join_columns=[], debug=False):
+# The named groups of a regex text, these are tagged with the branch in the fused regex
+NAMED_GROUP_PATTERN = re.compile(r"(?<!\\)\(\?P<(\w+)>")
+
+
+def has_group_references(items):
+    for op, av in items:
+        if op in (sre_parser.GROUPREF, sre_parser.GROUPREF_EXISTS):
+            return True
+
+        for sub_item in (av if isinstance(av, (tuple, list)) else [av]):
+            sub_items = sub_item if isinstance(sub_item, list) else [sub_item]
+            if any(isinstance(item, sre_parser.SubPattern) and has_group_references(item) for item in sub_items):
+                return True
+
+    return False
+
+
+# Fuses the regex_list into a single regex which gives the groups of the first regex whose anchor group matches.
+# Each regex is a branch \A(?=[\s\S]*?regex(?(anchor)|(?!))) looking ahead from the start of the value, hence a
+# branch finds the match the regex finds on its own. The named groups are tagged with the branch as _b<index>_<name>.
+# Returns (fused_regex, branches) with the (anchor_fused_column, [(fused_column, column), ...]) of each branch,
+# or None if the regexes cannot be fused i.e. the back references, the global inline flags and the regexes
+# without the anchor group.
+def get_fused_regexlist(regex_list, anchor_column, flags=re.MULTILINE):
+    fused_branches = []
+    branches = []
+    group_offset = 0
+    for index, regex_text in enumerate(regex_list):
+        try:
+            pattern = re.compile(regex_text, flags)
+            if has_group_references(sre_parser.parse(regex_text, flags)):
+                return None
+        except re.error:
+            return None
+
+        columns = get_extract_columns(pattern)
+        if anchor_column not in columns:
+            return None
+
+        branch_prefix = "_b{}_".format(index)
+        tagged_regex_text = NAMED_GROUP_PATTERN.sub(lambda m: "(?P<{}{}>".format(branch_prefix, m.group(1)),
+                                                    regex_text)
+
+        # The fused columns are named as extract names them
+        fused_columns = [branch_prefix + column if isinstance(column, str) else group_offset + column
+                         for column in columns]
+        anchor_index = columns.index(anchor_column)
+        fused_branches.append(r"(?=[\s\S]*?(?:{})(?({})|(?!)))".format(tagged_regex_text,
+                                                                      group_offset + anchor_index + 1))
+        branches.append((fused_columns[anchor_index], list(zip(fused_columns, columns))))
+
+        group_offset += pattern.groups
+
+    fused_regex = r"\A(?:{})".format("|".join(fused_branches))
+    try:
+        fused_pattern = re.compile(fused_regex, flags)
+    except re.error:
+        return None
+
+    # The tagging is verified, an escaped group lookalike in a regex would be tagged as well
+    if get_extract_columns(fused_pattern) != [fused_column for _, columns in branches for fused_column, _ in columns]:
+        return None
+
+    return fused_regex, branches
+
+
+# A single scan of the column with the fused regex, see get_fused_regexlist()
+def df_apply_fused_regexlist_on_column(df, fused_regexlist, column):
+    fused_regex, branches = fused_regexlist
+    fused_df = df[column].str.extract(fused_regex, re.MULTILINE, expand=True)
+
+    match_df = None
+    for anchor_fused_column, columns in branches:
+        fused_columns = [fused_column for fused_column, _ in columns]
+        new_columns = [new_column for _, new_column in columns]
+
+        if match_df is None:
+            match_df = fused_df[fused_columns].copy()
+            match_df.columns = new_columns
+        else:
+            # The columns first set by the branch take the dtypes of the fused columns
+            for fused_column, new_column in columns:
+                if new_column not in match_df.columns:
+                    match_df[new_column] = pd.Series(np.nan, index=match_df.index,
+                                                     dtype=fused_df[fused_column].dtype)
+
+            # The branches are exclusive, only the rows of the branch are set
+            branch_rows = fused_df[anchor_fused_column].notna()
+            match_df.loc[branch_rows, new_columns] = fused_df.loc[branch_rows, fused_columns].set_axis(
+                new_columns, axis=1)
+
+    return match_df
+
+
+# With cascade, each regex after the first is applied only on the rows where new_anchor_column is not set yet.
+# With fuse, the regex_list is applied as a single fused regex (see get_fused_regexlist()), in which the anchor group
+# of each regex is taken as mandatory. The regex_list which cannot be fused is cascaded.
+# The cascade and the fuse apply when new_anchor_column is given and not multiple.
+def df_apply_regexlist_on_column(df, regex_list, column=None, new_anchor_column=None, remove=True, multiple=False, join_original=True, join_columns=[], cascade=True, fuse=False, debug=False):
     if column is None:
         raise RuntimeError("column cannot be None")
 
@@ -187,7 +510,20 @@ def df_apply_regexlist_on_column(df, regex_list, column=None, new_anchor_column=
         logger.info("df_apply_regexlist_on_column(): Input frame")
         df_print(df[column])
 
+    fused_regexlist = None
+    if fuse and new_anchor_column is not None and not multiple and len(regex_list) > 1:
+        if not column in df.columns:
+            raise RuntimeError("column '{}' not found in columns: {}".format(column, df.columns))
+
+        fused_regexlist = get_fused_regexlist(regex_list, new_anchor_column)
+        if debug:
+            logger.info("fused={}".format(fused_regexlist is not None))
+
     match_df = None
+    if fused_regexlist is not None:
+        match_df = df_apply_fused_regexlist_on_column(df, fused_regexlist, column)
+        regex_list = []
+
     for index, regex_text in enumerate(regex_list):
         if debug:
             logger.info("regex={}".format(regex_text))
@@ -201,6 +537,10 @@ def df_apply_regexlist_on_column(df, regex_list, column=None, new_anchor_column=
             if debug:
                 logger.info("New DF: Index Level Count: {}".format(index_level_count))
             new_df = new_df.droplevel(index_level_count - 1)
+        elif cascade and match_df is not None and new_anchor_column is not None:
+            # Only the rows which are set below are scanned
+            unmatched_rows = match_df[new_anchor_column].isna().values
+            new_df = df[column][unmatched_rows].str.extract(regex_text, re.MULTILINE, expand=True)
         else:
             new_df = df[column].str.extract(regex_text, re.MULTILINE, expand=True)
 
@@ -236,22 +576,57 @@ def df_apply_regexlist_on_column(df, regex_list, column=None, new_anchor_column=
 FLAG_ACTIVE_DEFAULT = True
 FLAG_FORCE_LOCATION = False
 
-def df_print(df, count=20, dtypes=False, index=False, shape=False, new_line=True, gui=False, active=True, location=True, columns=False):
-    if not active:
+# The display options of the df_print() output, scoped to the formatting
+DF_PRINT_DISPLAY_OPTIONS = (
+    'display.max_rows', None,
+    'display.max_columns', None,
+    'display.width', None,
+    'display.max_colwidth', None,
+    'display.float_format', lambda x: '%.2f' % x,
+)
+
+# The calls and the last print time of each df_print() call site, for the sampling
+df_print_call_counts = {}
+df_print_print_times = {}
+
+
+# With sample_every=n only every nth call from a call site prints, and with min_interval a call site prints at
+# most once in min_interval seconds.
+def is_df_print_sampled(call_site, sample_every=1, min_interval=None):
+    call_count = df_print_call_counts.get(call_site, 0)
+    df_print_call_counts[call_site] = call_count + 1
+    if sample_every > 1 and call_count % sample_every != 0:
+        return False
+
+    if min_interval is not None:
+        now = time.monotonic()
+        last_print_time = df_print_print_times.get(call_site)
+        if last_print_time is not None and now - last_print_time < min_interval:
+            return False
+        df_print_print_times[call_site] = now
+
+    return True
+
+
+# Does nothing unless the logger is enabled for INFO, so that the debug calls cost nothing otherwise.
+# The frame is formatted under the DF_PRINT_DISPLAY_OPTIONS, the global pandas options are not changed.
+def df_print(df, count=20, dtypes=False, index=False, shape=False, new_line=True, gui=False, active=True, location=True, columns=False,
+             sample_every=1, min_interval=None):
+    if not active or not logger.isEnabledFor(logging.INFO):
         return
 
+    if sample_every > 1 or min_interval is not None:
+        caller_frame = sys._getframe(1)
+        if not is_df_print_sampled((caller_frame.f_code.co_filename, caller_frame.f_lineno),
+                                   sample_every=sample_every, min_interval=min_interval):
+            return
+
     # https://stackoverflow.com/questions/6810999/how-to-determine-file-function-and-line-number
 
     # Use this as a decorator
     if location or FLAG_FORCE_LOCATION:
         print_file_function(offset=1, levels=4)
 
-    pd.set_option('display.max_rows', None)
-    pd.set_option('display.max_columns', None)
-    pd.set_option('display.width', None)
-    pd.set_option('display.max_colwidth', None)
-    pd.set_option('display.float_format', lambda x: '%.2f' % x)
-
     if gui:
         # gui = show(df, settings={'block': True})
         logger.info("pandas_gui not used")
@@ -262,19 +637,20 @@ def df_print(df, count=20, dtypes=False, index=False, shape=False, new_line=True
         if new_line:
             logger.info("\n")
 
-        logger.info(df)
+        with pd.option_context(*DF_PRINT_DISPLAY_OPTIONS):
+            logger.info(str(df))
 
-        if index:
-            logger.info(df.index)
+            if index:
+                logger.info(str(df.index))
 
-        if shape:
-            logger.info(df.shape)
+            if shape:
+                logger.info(df.shape)
 
-        if dtypes:
-            logger.info(df.dtypes)
+            if dtypes:
+                logger.info(str(df.dtypes))
 
-        if columns:
-            logger.info(df.columns)
+            if columns:
+                logger.info(str(df.columns))
 
 
 def df_read_excel(*args, **kwargs):
@@ -469,31 +845,112 @@ def get_cell_type_signature(cell):
     return type(cell).__name__
 
 
+# The accepted types of each cell_filter of a row signature, see filter_by_signature_and_value()
+def get_signature_accepted_types(row_signature):
+    signature_accepted_types = []
+    for cell_filter in row_signature:
+        accepted_types = cell_filter.get("types")
+        if accepted_types is None:
+            accepted_type = cell_filter.get("type")
+            if isinstance(accepted_type, list):
+                raise RuntimeError("Only one type accepted. For multiple use types")
+            accepted_types = [accepted_type]
+        else:
+            if not isinstance(accepted_types, list):
+                raise RuntimeError("Specify types in a list format")
+
+        signature_accepted_types.append(set(accepted_types))
+
+    return signature_accepted_types
+
+
+# The numpy dtype kinds of the scalars of the rows, see get_column_cell_types()
+cell_kind_type_map = {
+    "i": "int",
+    "u": "int",
+    "f": "float",
+    "b": "bool",
+    "c": "complex",
+}
+
+
+# The type names of the cells of the column as the rows of df.apply(axis=1) have them, as (type_names, codes) with
+# the codes indexing the type_names. The rows are of the common dtype of the columns, hence e.g. the cells of an int
+# column are float in a frame of int and float columns.
+# The types are known from the dtypes except for the object columns and the rows of an extension dtype e.g. with
+# the nullable columns, which are typed per cell.
+def get_column_cell_types(column, row_dtype):
+    if isinstance(row_dtype, pd.api.extensions.ExtensionDtype):
+        # The rows are the scalars of the extension array
+        cells = pd.Series(list(column.astype(row_dtype)), dtype=object)
+    else:
+        dtype = column.dtype
+        is_numpy_dtype = isinstance(dtype, np.dtype)
+        kind = row_dtype.kind if row_dtype != object else dtype.kind
+
+        if kind in cell_kind_type_map and (row_dtype != object or is_numpy_dtype):
+            return [cell_kind_type_map[kind]], np.zeros(len(column), dtype=np.intp)
+
+        if kind in ("M", "m") and (row_dtype != object or is_numpy_dtype or isinstance(dtype, pd.DatetimeTZDtype)):
+            valid_type = "Timestamp" if kind == "M" else "Timedelta"
+            return [valid_type, "NaTType"], column.isna().to_numpy().astype(np.intp)
+
+        if isinstance(dtype, pd.StringDtype):
+            return ["str", type(dtype.na_value).__name__], column.isna().to_numpy().astype(np.intp)
+
+        cells = column.astype(object)
+
+    codes, cell_types = pd.factorize(cells.map(type), use_na_sentinel=False)
+    return [cell_type.__name__ for cell_type in cell_types], codes
+
+
+def get_frame_cell_types(df):
+    if len(df) == 0:
+        return [([], np.zeros(0, dtype=np.intp)) for _ in df.columns]
+
+    # The dtype the rows are interleaved to
+    row_dtype = df.iloc[0].dtype
+    return [get_column_cell_types(df.iloc[:, position], row_dtype) for position in range(len(df.columns))]
+
+
+# Vectorised filter_by_signature_and_value() over the rows of the frame, returns the boolean array of the rows
+def get_signature_row_mask(frame_cell_types, row_count, signature_accepted_types):
+    row_mask = np.ones(row_count, dtype=bool)
+    for (type_names, codes), accepted_types in zip(frame_cell_types, signature_accepted_types):
+        accepted_codes = [code for code, type_name in enumerate(type_names) if type_name in accepted_types]
+        row_mask &= np.isin(codes, accepted_codes)
+
+    return row_mask
+
+
 def df_type_signature(df):
-    return df.applymap(lambda x: get_cell_type_signature(x))
+    data = OrderedDict()
+    for column, (type_names, codes) in zip(df.columns, get_frame_cell_types(df)):
+        data[column] = np.array(type_names, dtype=object)[codes]
 
+    signature_df = pd.DataFrame(data, index=df.index)
+    signature_df.columns = df.columns
+    return signature_df
 
+
+# The signatures are compiled once into the accepted types of each column, the cell types are computed per
+# column and the rows are filtered with a boolean reduction across the columns
 def df_filter_by_row_and_header_signature(df, row_signature, header_signature=None, match_strategy='exact', debug=False):
     logger.info("df_filter_by_row_signature():")
     logger.info("signature: {}".format(row_signature))
     logger.info("header_signature: {}".format(header_signature))
 
-    # This is currently not used
-    signature_df = df_type_signature(df)
-    if debug or True:
+    if debug:
         logger.info("signature_df: ")
-        df_print(signature_df, columns=True, shape=True)
+        df_print(df_type_signature(df), columns=True, shape=True)
 
-    boolean_frame = df.apply(
-        lambda row: filter_by_row_and_header_signature_and_value(row,
-                                                                 row_signature,
-                                                                 header_signature=header_signature,
-                                                                 match_strategy=match_strategy),
-        axis=1
-    )
+    frame_cell_types = get_frame_cell_types(df)
 
-    return df[boolean_frame]
+    row_mask = get_signature_row_mask(frame_cell_types, len(df), get_signature_accepted_types(row_signature))
+    if header_signature is not None:
+        row_mask |= get_signature_row_mask(frame_cell_types, len(df), get_signature_accepted_types(header_signature))
 
+    return df[row_mask]
 
 
 def df_is_empty(df):
@@ -1,4 +1,4 @@
-import inspect
+import sys
 import os
 import json
 
@@ -15,13 +15,20 @@ def print_file_function(active=FLAG_ACTIVE_DEFAULT, offset=0, levels=1):
         return
 
     print(os.getcwd())
+
+    # The frames are walked up, inspect.stack() would read the source context of the whole stack
+    try:
+        frame = sys._getframe(offset + 1)
+    except ValueError:
+        return
+
     for level in range(levels):
-        caller_frame_record = inspect.stack()[level+offset+1]
-        frame = caller_frame_record[0]
-        info = inspect.getframeinfo(frame)
-        file = info.filename
-        relative_file_path = os.path.relpath(file, PROJECT_DIR)
-        print('[{}:{} {}()]'.format(relative_file_path, info.lineno, info.function))
+        if frame is None:
+            break
+
+        relative_file_path = os.path.relpath(frame.f_code.co_filename, PROJECT_DIR)
+        print('[{}:{} {}()]'.format(relative_file_path, frame.f_lineno, frame.f_code.co_name))
+        frame = frame.f_back
 
 
 def debug_log(*args, **kwargs):
@@ -13,3 +13,12 @@ class InvalidParams(Exception):
         rv = dict(self.payload or ())
         rv['message'] = self.message
         return rv
+
+
+class RegexTimeout(Exception):
+    def __init__(self, message, regex_str=None, timeout=None, document=None):
+        Exception.__init__(self, message)
+        self.message = message
+        self.regex_str = regex_str
+        self.timeout = timeout
+        self.document = document
@@ -1,5 +1,8 @@
 from utils.date_utils import get_date_from_string
-from utils.dataframe.dataframe_utils import create_df_from_text_using_regex
+from utils.dataframe.dataframe_utils import extract_dataframe_from_text, df_new_dataframe
+from utils.regex.apply import warm, regex_has_match
+from utils.regex.budget import run_with_budget
+from utils.exceptions import RegexTimeout
 from .normalize import normalize_trades, normalize_expenses
 from utils.markers.zerodha.contractnote_marker import get_zerodha_markers
 from utils.markers.axisdirect.contractnote_marker import get_axisdirect_markers
@@ -24,11 +27,50 @@ def get_markers(account, document_type):
         return None
 
 
+def get_marker_regexes(markers):
+    regexes = []
+    for marker in markers:
+        marker_regexes = [marker['regex']] + [bound['regex'] for bound in marker.get('bounded', [])]
+        for regex in marker_regexes:
+            regexes.extend([regex] if not isinstance(regex, list) else regex)
+
+    return regexes
+
+
+def get_all_markers():
+    return get_zerodha_markers() + get_axisdirect_markers() + get_indiainfoline_markers()
+
+
+# Precompiles the regexes of the markers of all the accounts, to be called at worker startup
+def warm_marker_regexes(markers=None):
+    if markers is None:
+        markers = get_all_markers()
+
+    regexes = get_marker_regexes(markers)
+    errors = {}
+    errors.update(warm(regexes))
+    errors.update(warm(regexes, flags={"multiline": True}))
+
+    return errors
+
+
+# The backend gives the frame of extractall, see extract_dataframe_from_text()
 def process_text_with_regex(input_text, regex_text):
-    return create_df_from_text_using_regex(regex_text, input_text)
+    return extract_dataframe_from_text(regex_text, input_text, backend="auto")
+
+
+# The probe stops at the first match. The extraction is skipped for a marker which does not match.
+def process_text_with_marker_regex(input_text, regex_text):
+    if regex_has_match(regex_text, input_text, flags={"multiline": True}):
+        return process_text_with_regex(input_text, regex_text)
+
+    return df_new_dataframe()
+
 
 # markers is an array of regex followed with post processing functions
-def process_text_with_markers(input_text, markers, meta_data, debug=True):
+# With a timeout each of the marker regexes is run in a worker process which is killed once the timeout is over.
+# A marker regex which times out is taken as not matched and is reported in meta_data['regex_timeouts'].
+def process_text_with_markers(input_text, markers, meta_data, debug=True, timeout=None):
     file_date = meta_data['file_date']
     if debug:
         print("process_text_with_markers(): file_date={}".format(file_date))
@@ -58,7 +100,17 @@ def process_text_with_markers(input_text, markers, meta_data, debug=True):
 
         ri = 0
         for regex in regexlist:
-            df = process_text_with_regex(input_text, regex)
+            if timeout is None:
+                df = process_text_with_marker_regex(input_text, regex)
+            else:
+                try:
+                    df = run_with_budget(process_text_with_marker_regex, args=(input_text, regex), timeout=timeout,
+                                         regex_str=regex, document=meta_data.get('file_path'))
+                except RegexTimeout as e:
+                    print('Marker {}[{}] timed out: {}'.format(marker_type, ri, e.message))
+                    meta_data.setdefault('regex_timeouts', []).append({'type': marker_type, 'index': ri,
+                                                                       'message': e.message})
+                    df = df_new_dataframe()
 
             if not df.empty:
                 # call the post processing function if it exists
@@ -1,32 +1,103 @@
 import re
-from utils.exceptions import InvalidParams
-from utils.text.lines import get_multiline_post_para_offsets, get_matches_with_group_relative_offsets,\
-    combine_matches_with_post_groups, print_combined_matches, print_matches_with_post_groups, \
-    extend_match_groups_with_post_groups, set_groups_absolute_offset
+import time
+from array import array
+from itertools import chain
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Tuple
+from utils.exceptions import InvalidParams, RegexTimeout
+from utils.regex.budget import run_with_budget
+from utils.regex.profiler import regex_profiler
+from utils.regex.engine import compile_pattern, get_engine_error, get_pattern_engine, get_match_regs
+from utils.text.lines import get_matches_with_extended_groups_absolute
 import logging
 
 
 logger = logging.getLogger(__name__)
 
 
-# Ref:
-# https://stackoverflow.com/questions/19630994/how-to-check-if-a-string-is-a-valid-regex-in-python
-#
-def check_compile_regex(regex_str, flags=None):
-    pattern = None
-    error = None
-
+def get_re_flags(flags=None):
     re_flags = 0
     if flags is not None:
         re_flags |= re.MULTILINE if flags.get('multiline', False) else 0
         re_flags |= re.DOTALL if flags.get('dotall', False) else 0
 
-    try:
-        pattern = re.compile(regex_str, re_flags)
-    except re.error as e:
-        error = str(e)
+    return re_flags
+
+
+# Size bounded LRU of the compiled patterns keyed on (regex_str, re_flags, engine).
+# The compile errors are cached as well, as (None, error).
+# The re module cache is small and is cleared wholesale once full, which happens quickly with the marker
+# regexes and the generated group regexes.
+@dataclass
+class RegexCache:
+    max_size: int = 1024
+    entries: OrderedDict = field(init=False, default_factory=OrderedDict)
+    hits: int = field(init=False, default=0)
+    misses: int = field(init=False, default=0)
+    evictions: int = field(init=False, default=0)
+
+    def get(self, regex_str, re_flags=0, engine=None):
+        engine = get_pattern_engine(regex_str, engine=engine)
+        key = (regex_str, re_flags, engine)
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+        self.misses += 1
+
+        pattern = None
+        error = None
+        compile_start_time = time.perf_counter()
+        try:
+            pattern = compile_pattern(regex_str, re_flags, engine=engine)
+        except (re.error, get_engine_error(engine)) as e:
+            error = str(e)
+
+        if regex_profiler.enabled:
+            regex_profiler.record_compile(pattern.pattern if pattern is not None else regex_str,
+                                          getattr(pattern, 'flags', re_flags),
+                                          time.perf_counter() - compile_start_time)
+
+        self.entries[key] = (pattern, error)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+        return pattern, error
+
+    def stats(self):
+        return {"size": len(self.entries), "max_size": self.max_size,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
 
-    return pattern, error
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+regex_cache = RegexCache()
+
+
+# Ref:
+# https://stackoverflow.com/questions/19630994/how-to-check-if-a-string-is-a-valid-regex-in-python
+#
+# The engine is the one selected for the regex_str unless specified, see utils.regex.engine
+def check_compile_regex(regex_str, flags=None, engine=None):
+    return regex_cache.get(regex_str, get_re_flags(flags), engine=engine)
+
+
+# Precompiles the regexes e.g. at worker startup. Returns the errors by regex_str.
+def warm(regex_strs, flags=None):
+    errors = {}
+    for regex_str in regex_strs:
+        pattern, error = check_compile_regex(regex_str, flags=flags)
+        if error is not None:
+            errors[regex_str] = error
+
+    return errors
 
 
 def regex_apply_on_text_enhanced(regex_str, text, flags=None, extrapolate=False, debug=False):
@@ -44,26 +115,16 @@ def regex_apply_on_text_enhanced(regex_str, text, flags=None, extrapolate=False,
         extrapolate_new_approach = False
 
         if not extrapolate_new_approach:
-            multiline_matches = get_multiline_post_para_offsets(result['matches'], len(text))
-
-            matches_with_post_groups = get_matches_with_group_relative_offsets(text, multiline_matches)
-
-            if debug:
-                print("Matches with post groups")
-                for m in matches_with_post_groups:
-                    print(m)
-
-            matches_with_extended_groups = extend_match_groups_with_post_groups(matches_with_post_groups)
+            # Single pass over the matches and their post paras
+            matches_with_absolute_offsets = get_matches_with_extended_groups_absolute(text, result['matches'])
 
             if debug:
                 print("Matches with extended groups")
-                for m in matches_with_extended_groups:
+                for m in matches_with_absolute_offsets:
                     print(m)
 
-            matches_with_absolute_offsets = set_groups_absolute_offset(matches_with_extended_groups)
-
-            if debug or True:
-                logger.info("multiline_matches with absolute offsets:{}".format(matches_with_absolute_offsets))
+            # The matches are formatted only if the logger is enabled
+            logger.info("multiline_matches with absolute offsets:%s", matches_with_absolute_offsets)
 
             result['matches'] = matches_with_absolute_offsets
         else:
@@ -89,8 +150,22 @@ def regex_apply_on_text_enhanced(regex_str, text, flags=None, extrapolate=False,
     return result
 
 
-def regex_apply_on_text(regex_str, text, flags=None):
-    pattern, regex_error = check_compile_regex(regex_str, flags=flags)
+# With a timeout the regex is applied in a worker process which is killed once the timeout is over.
+# The result then has 'timeout' set, and the error tells the regex and the document which timed out.
+def regex_apply_on_text(regex_str, text, flags=None, timeout=None, document=None, engine=None):
+    if timeout is not None:
+        # The engine selection is not shared with the worker process, hence sent along
+        try:
+            result = run_with_budget(regex_apply_on_text, args=(regex_str, text),
+                                     kwargs={"flags": flags, "engine": get_pattern_engine(regex_str, engine=engine)},
+                                     timeout=timeout, regex_str=regex_str, document=document)
+        except RegexTimeout as e:
+            return {"matches": [], "error": e.message, "timeout": True}
+
+        result['timeout'] = False
+        return result
+
+    pattern, regex_error = check_compile_regex(regex_str, flags=flags, engine=engine)
 
     matches = []
     if not regex_error:
@@ -99,33 +174,211 @@ def regex_apply_on_text(regex_str, text, flags=None):
     return {"matches": matches, "error": regex_error}
 
 
-def regex_pattern_apply_on_text(regex_pattern, text):
-    groups_dict = dict(regex_pattern.groupindex)
+# Lazy version of regex_apply_on_text(). The matches are yielded as they are found, so that the callers can stop
+# early. The regex errors are raised as InvalidParams right away rather than on the first next().
+def regex_iter_on_text(regex_str, text, flags=None, start=0, end=None, max_matches=None, first_only=False):
+    pattern, regex_error = check_compile_regex(regex_str, flags=flags)
+
+    if regex_error is not None:
+        raise InvalidParams('Regex Error: ' + regex_error)
+
+    return regex_pattern_iter_on_text(pattern, text, start=start, end=end,
+                                      max_matches=max_matches, first_only=first_only)
+
+
+def regex_pattern_iter_on_text(regex_pattern, text, start=0, end=None, max_matches=None, first_only=False):
+    group_titles = get_group_titles(regex_pattern)
+
+    if end is None:
+        end = len(text)
+
+    if first_only:
+        max_matches = 1
+
+    if max_matches is not None and max_matches <= 0:
+        return
+
+    match_count = 0
+    for m in get_pattern_matches_iter(regex_pattern, text, start, end):
+        match_object = [text[m.start():m.end()], m.start(), m.end()]
+        groups_object = get_group_offsets(text, m, regex_pattern.groupindex, group_titles=group_titles)
+        yield {"match": match_object, "groups": groups_object}
+
+        match_count += 1
+        if max_matches is not None and match_count >= max_matches:
+            break
+
+
+# Stops at the first match. Returns False for an invalid regex.
+def regex_has_match(regex_str, text, flags=None, start=0, end=None):
+    pattern, regex_error = check_compile_regex(regex_str, flags=flags)
+
+    if regex_error is not None:
+        return False
+
+    if end is None:
+        end = len(text)
+
+    search_start_time = time.perf_counter()
+    m = pattern.search(text, start, end)
+
+    if regex_profiler.enabled:
+        regex_profiler.record_scan(pattern, max(min(end, len(text)) - start, 0),
+                                   time.perf_counter() - search_start_time, 1 if m is not None else 0)
+
+    return m is not None
+
+
+# The regex is applied on each of the (start, end) spans of the text. The offsets are from the start of the text.
+def regex_apply_on_text_spans(regex_str, text, spans, flags=None):
+    pattern, regex_error = check_compile_regex(regex_str, flags=flags)
+
+    matches = []
+    if not regex_error:
+        for span_start, span_end in spans:
+            matches.extend(regex_pattern_apply_on_text(pattern, text, pos=span_start, endpos=span_end))
+
+    return {"matches": matches, "error": regex_error}
+
+
+# The matches of the pattern within text[pos:endpos], profiled when the regex_profiler is enabled
+def get_pattern_matches_iter(regex_pattern, text, pos=0, endpos=None):
+    if endpos is None:
+        endpos = len(text)
+
+    matches_iter = regex_pattern.finditer(text, pos, endpos)
+    if regex_profiler.enabled:
+        matches_iter = regex_profiler.profile_matches(regex_pattern, matches_iter,
+                                                      max(min(endpos, len(text)) - pos, 0))
+
+    return matches_iter
+
+
+def regex_pattern_apply_on_text(regex_pattern, text, pos=0, endpos=None):
+    group_titles = get_group_titles(regex_pattern)
+
+    if endpos is None:
+        endpos = len(text)
 
     matches = []
-    for m in regex_pattern.finditer(text):
+    for m in get_pattern_matches_iter(regex_pattern, text, pos, endpos):
         match_object = [text[m.start():m.end()], m.start(), m.end()]
-        groups_object = get_group_offsets(text, m, groups_dict)
+        groups_object = get_group_offsets(text, m, regex_pattern.groupindex, group_titles=group_titles)
         matches.append({"match": match_object, "groups": groups_object})
 
     return matches
 
 
-def get_group_offsets(text, match, groups_dict):
+# The title of each group of the pattern: the group name, else the group index
+def get_group_titles(regex_pattern):
+    reverse_group_dict = {v: k for k, v in regex_pattern.groupindex.items()}
+    return tuple(reverse_group_dict.get(index, str(index)) for index in range(1, regex_pattern.groups + 1))
+
+
+def get_group_offsets(text, match, groups_dict, group_titles=None):
     groups = match.groups()
-    reverse_group_dict = {v:k for k,v in groups_dict.items()}
+    if group_titles is None:
+        reverse_group_dict = {v:k for k,v in groups_dict.items()}
+        group_titles = tuple(reverse_group_dict.get(index, str(index)) for index in range(1, len(groups)+1))
 
     result = []
     for index in range(1, len(groups)+1):
         group_start, group_end = match.span(index)
         group_text = match.group(index)
-        title = reverse_group_dict[index] if index in reverse_group_dict else str(index)
-        result.append([group_text, group_start, group_end, title])
+        result.append([group_text, group_start, group_end, group_titles[index-1]])
 
     # debug_log(result)
     return result
 
 
+# Columnar form of the result of regex_pattern_apply_on_text().
+# The spans of each match are kept in a row of the spans array: the match (start, end) followed by the (start, end)
+# of each group. A group which did not participate in the match has the span (-1, -1).
+# The group titles are shared by all the matches and the text is sliced only on access.
+# Indexing and iterating give the match dicts of regex_pattern_apply_on_text(), so callers can migrate incrementally.
+@dataclass
+class MatchSpans:
+    text: str
+    group_titles: Tuple
+    spans: array = field(default_factory=lambda: array('q'))
+
+    @property
+    def row_width(self):
+        return 2 * (len(self.group_titles) + 1)
+
+    def __len__(self):
+        return len(self.spans) // self.row_width
+
+    def match_span(self, match_index):
+        row_start = match_index * self.row_width
+        return self.spans[row_start], self.spans[row_start + 1]
+
+    def match_text(self, match_index):
+        match_start, match_end = self.match_span(match_index)
+        return self.text[match_start:match_end]
+
+    # The group_index starts from 1 as in re
+    def group_span(self, match_index, group_index):
+        span_start = match_index * self.row_width + 2 * group_index
+        return self.spans[span_start], self.spans[span_start + 1]
+
+    def group_text(self, match_index, group_index):
+        group_start, group_end = self.group_span(match_index, group_index)
+        if group_start < 0:
+            return None
+        return self.text[group_start:group_end]
+
+    def __getitem__(self, match_index):
+        if match_index < 0:
+            match_index += len(self)
+        if match_index < 0 or match_index >= len(self):
+            raise IndexError("match index out of range")
+
+        match_start, match_end = self.match_span(match_index)
+        groups = []
+        for group_index, title in enumerate(self.group_titles, 1):
+            group_start, group_end = self.group_span(match_index, group_index)
+            groups.append([self.group_text(match_index, group_index), group_start, group_end, title])
+
+        return {"match": [self.text[match_start:match_end], match_start, match_end], "groups": groups}
+
+    def __iter__(self):
+        for match_index in range(len(self)):
+            yield self[match_index]
+
+    def to_matches(self):
+        return list(self)
+
+    # The spans as a (match_count, group_count + 1, 2) numpy array, sharing the memory of spans
+    def to_numpy(self):
+        import numpy as np
+
+        return np.frombuffer(self.spans, dtype=np.int64).reshape(len(self), len(self.group_titles) + 1, 2)
+
+
+def regex_pattern_apply_on_text_columnar(regex_pattern, text, pos=0, endpos=None):
+    if endpos is None:
+        endpos = len(text)
+
+    match_spans = MatchSpans(text, get_group_titles(regex_pattern))
+    # The regs of a match are the spans of the match followed by the spans of the groups
+    match_spans.spans.extend(chain.from_iterable(chain.from_iterable(
+        map(lambda m: get_match_regs(m, regex_pattern.groups), get_pattern_matches_iter(regex_pattern, text, pos, endpos))
+    )))
+
+    return match_spans
+
+
+def regex_apply_on_text_columnar(regex_str, text, flags=None):
+    pattern, regex_error = check_compile_regex(regex_str, flags=flags)
+
+    matches = MatchSpans(text, ())
+    if not regex_error:
+        matches = regex_pattern_apply_on_text_columnar(pattern, text)
+
+    return {"matches": matches, "error": regex_error}
+
+
 def regex_create_html(regex_str, text, flags=None):
     pattern, regex_error = check_compile_regex(regex_str, flags=flags)
 
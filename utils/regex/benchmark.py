@@ -0,0 +1,279 @@
+import time
+import random
+from utils.regex.builder import RegexDictionary, RegexGenerator, RegexTextProcessor
+from utils.regex.sample import get_sample_hdfc_regex_token_sequence
+import pandas as pd
+from utils.dataframe.dataframe_utils import EXTRACTION_BACKENDS, extract_dataframe_from_text, get_fixed_width_fields, \
+    df_apply_regexlist_on_column
+from utils.regex.apply import check_compile_regex
+from utils.markers.handlers import get_marker_regexes, get_all_markers
+
+
+# The fixed width layout of the lines of generate_hdfc_statement_text()
+HDFC_FIXED_WIDTH_REGEX = r"^.(?P<Date>.{8}).(?P<Description>.{40}).{12}(?P<RefNum>.{16}).(?P<ValueDate>.{8})" \
+                         r".{25}(?P<Debit>.{10}).{15}(?P<Credit>.{10}).{18}(?P<Balance>.{8})$"
+
+
+# Synthetic bank statement shaped text: transaction lines, narration continuation lines,
+# page headers and blank lines
+def generate_statement_text(line_count, seed=1):
+    rnd = random.Random(seed)
+
+    lines = []
+    for index in range(line_count):
+        kind = rnd.randint(0, 5)
+        day = index % 28 + 1
+        month = index % 12 + 1
+        if kind == 0:
+            lines.append(" {:02d}/{:02d}/21  UPI-PAYMENT TO SHOP {}       {:016d} {:02d}/{:02d}/21        {}.00"
+                         "                 {},{:03d}.50".format(day, month, index, index, day, month,
+                                                               index % 9999, index % 99, index % 999))
+        elif kind == 1:
+            lines.append("                          CONTINUED NARRATION {}".format(index))
+        elif kind == 2:
+            lines.append("")
+        elif kind == 3:
+            lines.append("  Statement of account  page {}   01/01/2021".format(index))
+        elif kind == 4:
+            lines.append(" {:02d}/{:02d}/2021  NEFT CR  X  {}          {}.50  ".format(day, month, index, index))
+        else:
+            lines.append("   ")
+
+    return "\n".join(lines)
+
+
+# HDFC statement shaped text for get_sample_hdfc_regex_token_sequence(). The transaction lines are followed by
+# description continuation lines, some of them misaligned by a column, and the pages are separated by blank lines.
+def generate_hdfc_statement_text(transaction_count, page_size=40, seed=1):
+    rnd = random.Random(seed)
+
+    lines = []
+    for index in range(transaction_count):
+        description = "UPI PAY SHOP {}".format(index)
+        amount = "{}.00".format(index % 500 + 1)
+        debit, credit = (amount, " ") if index % 2 else (" ", amount)
+
+        line = "".join([" 01/02/21 ", description.ljust(40), " " * 12, "{:016d}".format(index), " 01/02/21",
+                        " " * 25, debit.rjust(10), " " * 15, credit.rjust(10), " " * 18, "1,234.50"])
+        lines.append(line)
+
+        for continuation_index in range(rnd.randint(0, 2)):
+            shift = rnd.choice([0, 0, 1])
+            continuation = "".join([" " * (10 + shift), "CONT{}".format(continuation_index).ljust(len(description))])
+            lines.append(continuation.ljust(len(line)))
+
+        if (index + 1) % page_size == 0:
+            lines.extend(["", "", "   Page {}".format((index + 1) // page_size), ""])
+
+    return "\n".join(lines)
+
+
+# Synthetic contract note shaped text: equity and derivative trade lines of the marker regexes, charges lines,
+# headers and blank lines
+def generate_contract_note_text(line_count, seed=1):
+    rnd = random.Random(seed)
+
+    lines = []
+    for index in range(line_count):
+        kind = rnd.randint(0, 5)
+        order_time = "{:02d}:{:02d}:{:02d}".format(9 + index % 6, index % 60, (index * 7) % 60)
+        trade_type = "B" if index % 2 else "S"
+        if kind == 0:
+            lines.append("{:016d}  {}  {:08d}  {}  INFY LTD {} NSE {} {}.{:02d} {}.{:02d} {}.{:02d}".format(
+                index, order_time, index, order_time, trade_type, index % 100 + 1, index % 2000, index % 100,
+                index % 2000, index % 100, index % 200000, index % 100))
+        elif kind == 1:
+            lines.append("{:016d}  {}  {:08d}  {}  NIFTY21JAN{}CE {} NFO {} {}.{:02d} {}.{:02d} ({}.{:02d})".format(
+                index, order_time, index, order_time, 14000 + index % 10 * 50, trade_type, index % 75 + 1,
+                index % 500, index % 100, index % 500, index % 100, index % 30000, index % 100))
+        elif kind == 2:
+            lines.append("")
+        elif kind == 3:
+            lines.append("  CONTRACT NOTE CUM TAX INVOICE   Trade Date {:02d}/01/2021".format(index % 28 + 1))
+        elif kind == 4:
+            lines.append("  Brokerage  {}.{:02d}   STT  {}.{:02d}".format(index % 100, index % 100, index % 50,
+                                                                         index % 100))
+        else:
+            lines.append("   ")
+
+    return "\n".join(lines)
+
+
+def time_function(function, *args, **kwargs):
+    start_time = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start_time
+
+
+def tokenize_lines(text, tokenizer):
+    regex_generator = RegexGenerator(RegexDictionary(), tokenizer=tokenizer)
+
+    token_streams = []
+    for line in text.split("\n"):
+        token_streams.append([(token.token, token.min_len, token.max_len, token_match)
+                              for token, token_match in regex_generator.generate_tokens(line)])
+
+    return token_streams
+
+
+def benchmark_tokenizer(line_count=100000, seed=1):
+    text = generate_statement_text(line_count, seed=seed)
+
+    dictionary_streams, dictionary_time = time_function(tokenize_lines, text, 'dictionary')
+    scanner_streams, scanner_time = time_function(tokenize_lines, text, 'scanner')
+
+    if dictionary_streams != scanner_streams:
+        raise RuntimeError("scanner tokenizer token streams differ from dictionary tokenizer")
+
+    print("Tokenizer Benchmark: lines={} chars={}".format(line_count, len(text)))
+    print("  {:<12}{:>10.3f}s".format("dictionary", dictionary_time))
+    print("  {:<12}{:>10.3f}s".format("scanner", scanner_time))
+    print("  {:<12}{:>10.2f}x".format("speedup", dictionary_time / scanner_time))
+
+    return {'dictionary': dictionary_time, 'scanner': scanner_time}
+
+
+def run_text_processor(text, parallel, whitespace_line_tolerance, alignment_tolerance, processes=None):
+    regex_processor = RegexTextProcessor(get_sample_hdfc_regex_token_sequence())
+    regex_processor.data = text
+
+    if parallel:
+        regex_processor.process_parallel(whitespace_line_tolerance=whitespace_line_tolerance,
+                                         alignment_tolerance=alignment_tolerance,
+                                         processes=processes)
+    else:
+        regex_processor.process(whitespace_line_tolerance=whitespace_line_tolerance,
+                                alignment_tolerance=alignment_tolerance)
+        regex_processor.generate_matches_absolute()
+        regex_processor.generate_frame_objects()
+
+    return regex_processor
+
+
+def benchmark_text_processor(transaction_count=100000, whitespace_line_tolerance=1, alignment_tolerance=1,
+                             processes=None, seed=1):
+    text = generate_hdfc_statement_text(transaction_count, seed=seed)
+
+    serial_processor, serial_time = time_function(run_text_processor, text, False,
+                                                  whitespace_line_tolerance, alignment_tolerance)
+    parallel_processor, parallel_time = time_function(run_text_processor, text, True,
+                                                      whitespace_line_tolerance, alignment_tolerance,
+                                                      processes=processes)
+
+    if serial_processor.frame_objects != parallel_processor.frame_objects or \
+            serial_processor.matches_with_absolute_offsets != parallel_processor.matches_with_absolute_offsets:
+        raise RuntimeError("parallel processor results differ from serial processor")
+
+    print("Text Processor Benchmark: transactions={} chars={}".format(transaction_count, len(text)))
+    print("  {:<12}{:>10.3f}s".format("serial", serial_time))
+    print("  {:<12}{:>10.3f}s".format("parallel", parallel_time))
+    print("  {:<12}{:>10.2f}x".format("speedup", serial_time / parallel_time))
+
+    return {'serial': serial_time, 'parallel': parallel_time}
+
+
+def get_frame_key(df):
+    return list(df.columns), list(df.dtypes), df.index.name, df.values.tolist()
+
+
+# Each applicable backend on the marker regexes over the contract notes and on the fixed width regex over the
+# statements. A backend is applicable to a regex if it compiles and, for fixed-width, if it is a fixed width regex.
+# Raises RuntimeError if a backend frame differs from that of extractall.
+def benchmark_extraction_backends(line_count=100000, seed=1):
+    cases = [(regex_str, generate_contract_note_text(line_count, seed=seed))
+             for regex_str in get_marker_regexes(get_all_markers())]
+    cases.append((HDFC_FIXED_WIDTH_REGEX, generate_hdfc_statement_text(line_count // 2, seed=seed)))
+
+    times = {backend: 0.0 for backend in EXTRACTION_BACKENDS}
+    fixed_width_times = {backend: 0.0 for backend in EXTRACTION_BACKENDS}
+    for regex_str, text in cases:
+        extract_pattern, regex_error = check_compile_regex(regex_str, flags={"multiline": True})
+        if regex_error is not None or extract_pattern.groups == 0:
+            continue
+
+        fixed_width = get_fixed_width_fields(extract_pattern) is not None
+
+        reference_key = None
+        for backend in EXTRACTION_BACKENDS:
+            if backend == "fixed-width" and not fixed_width:
+                continue
+
+            df, backend_time = time_function(extract_dataframe_from_text, regex_str, text, backend=backend)
+
+            frame_key = get_frame_key(df)
+            if reference_key is None:
+                reference_key = frame_key
+            elif frame_key != reference_key:
+                raise RuntimeError("backend '{}' frame differs from extractall for regex:\n{}".format(backend,
+                                                                                                   regex_str))
+
+            if fixed_width:
+                fixed_width_times[backend] += backend_time
+            else:
+                times[backend] += backend_time
+
+    print("Extraction Backend Benchmark: lines={} regexes={}".format(line_count, len(cases)))
+    print("  {:<20}{:>12}{:>16}".format("backend", "markers(s)", "fixed-width(s)"))
+    for backend in EXTRACTION_BACKENDS:
+        print("  {:<20}{:>12.3f}{:>16.3f}".format(backend, times[backend], fixed_width_times[backend]))
+
+    return {'markers': times, 'fixed-width': fixed_width_times}
+
+
+# The descriptions of a statement, each matched by one of DESCRIPTION_REGEX_LIST or by none
+DESCRIPTION_REGEX_LIST = [
+    r"NEFT CR-(?P<Ref>\d+)-(?P<Bank>[A-Z]+)",
+    r"UPI-(?P<Ref>\d+)-(?P<Payee>[A-Z]+)(?P<Note>#\d+)?",
+    r"ATW-(?P<Ref>\d+)-(?P<Atm>[A-Z]+)(?P<Never>!)?",
+]
+
+
+def generate_description_frame(row_count, seed=1):
+    rnd = random.Random(seed)
+
+    descriptions = []
+    for index in range(row_count):
+        kind = rnd.randint(0, 4)
+        if kind == 0:
+            descriptions.append("NEFT CR-{}-HDFC".format(index))
+        elif kind == 1:
+            descriptions.append("UPI-{}-SHOP#{}".format(index, index % 97))
+        elif kind == 2:
+            descriptions.append("ATW-{}-MUMBAI".format(index))
+        elif kind == 3:
+            descriptions.append("INTEREST PAID {}".format(index))
+        else:
+            descriptions.append(None)
+
+    return pd.DataFrame({'Description': descriptions, 'Amount': [index * 1.5 for index in range(row_count)]})
+
+
+# The fused regex list against the cascade, for both join_original modes.
+# Raises AssertionError if the fused frame differs from the cascade frame, dtypes included.
+def benchmark_regexlist_application(row_count=100000, seed=1):
+    df = generate_description_frame(row_count, seed=seed)
+
+    times = {}
+    for join_original in [True, False]:
+        cascade_df, cascade_time = time_function(df_apply_regexlist_on_column, df.copy(), DESCRIPTION_REGEX_LIST,
+                                                 column='Description', new_anchor_column='Ref',
+                                                 join_original=join_original, join_columns=['Amount'])
+        fused_df, fused_time = time_function(df_apply_regexlist_on_column, df.copy(), DESCRIPTION_REGEX_LIST,
+                                             column='Description', new_anchor_column='Ref',
+                                             join_original=join_original, join_columns=['Amount'], fuse=True)
+        pd.testing.assert_frame_equal(fused_df, cascade_df)
+        times[join_original] = {'cascade': cascade_time, 'fused': fused_time}
+
+    print("Regex List Benchmark: rows={} regexes={}".format(row_count, len(DESCRIPTION_REGEX_LIST)))
+    print("  {:<16}{:>12}{:>12}".format("join_original", "cascade(s)", "fused(s)"))
+    for join_original, result in times.items():
+        print("  {:<16}{:>12.3f}{:>12.3f}".format(str(join_original), result['cascade'], result['fused']))
+
+    return times
+
+
+if __name__ == "__main__":
+    benchmark_tokenizer()
+    benchmark_text_processor()
+    benchmark_extraction_backends()
+    benchmark_regexlist_application()
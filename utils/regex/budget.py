@@ -0,0 +1,103 @@
+import multiprocessing
+import threading
+from dataclasses import dataclass, field
+from typing import Optional
+from utils.exceptions import RegexTimeout
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+# Runs the requests sent over the connection till the connection is closed
+def budgeted_worker_loop(connection):
+    while True:
+        try:
+            function, args, kwargs = connection.recv()
+        except EOFError:
+            break
+
+        try:
+            connection.send(('ok', function(*args, **kwargs)))
+        except Exception as e:
+            connection.send(('error', e))
+
+
+# A worker process which is killed when a function runs over its time budget, and started again on the next run.
+# The functions and their arguments are sent to the worker, hence these have to be picklable.
+# The runs of the threads sharing a worker are serialised by the lock, so they do not interleave on the pipe.
+@dataclass
+class BudgetedWorker:
+    process: Optional[multiprocessing.Process] = field(init=False, default=None)
+    connection: Optional[object] = field(init=False, default=None)
+    lock: threading.Lock = field(init=False, default_factory=threading.Lock)
+
+    def start(self):
+        parent_connection, child_connection = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=budgeted_worker_loop, args=(child_connection,), daemon=True)
+        self.process.start()
+        child_connection.close()
+        self.connection = parent_connection
+
+    def stop(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.join()
+            self.connection.close()
+        self.process = None
+        self.connection = None
+
+    # Raises RegexTimeout if the function does not return within timeout seconds.
+    # Raises RuntimeError if the worker dies while running the function, the worker is started again on the next run.
+    def run(self, function, args=(), kwargs=None, timeout=None, regex_str=None, document=None):
+        with self.lock:
+            return self.run_locked(function, args=args, kwargs=kwargs, timeout=timeout, regex_str=regex_str,
+                                   document=document)
+
+    def run_locked(self, function, args=(), kwargs=None, timeout=None, regex_str=None, document=None):
+        if self.process is None or not self.process.is_alive():
+            self.start()
+
+        try:
+            self.connection.send((function, args, kwargs if kwargs is not None else {}))
+
+            if not self.connection.poll(timeout):
+                self.stop()
+                message = "Regex timed out after {}s on document '{}': {}".format(
+                    timeout, document, get_regex_summary(regex_str))
+                logger.error(message)
+                raise RegexTimeout(message, regex_str=regex_str, timeout=timeout, document=document)
+
+            status, value = self.connection.recv()
+        except (EOFError, OSError) as e:
+            process = self.process
+            self.stop()
+            exitcode = process.exitcode if process is not None else None
+            message = "Regex worker crashed with exit code {} on document '{}': {}".format(
+                exitcode, document, get_regex_summary(regex_str))
+            logger.error(message)
+            raise RuntimeError(message) from e
+
+        if status == 'error':
+            raise value
+
+        return value
+
+
+def get_regex_summary(regex_str, max_len=80):
+    if regex_str is None:
+        return None
+
+    regex_summary = " ".join(str(regex_str).split())
+    if len(regex_summary) > max_len:
+        regex_summary = "{}...".format(regex_summary[:max_len])
+
+    return regex_summary
+
+
+budgeted_worker = BudgetedWorker()
+
+
+def run_with_budget(function, args=(), kwargs=None, timeout=None, regex_str=None, document=None):
+    return budgeted_worker.run(function, args=args, kwargs=kwargs, timeout=timeout,
+                               regex_str=regex_str, document=document)
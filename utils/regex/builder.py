@@ -4,9 +4,16 @@ import re
 from enum import Enum
 from .wildcard import get_wildcard_str
 from .patterns import is_regex_comment_pattern, get_regex_comment_pattern, is_whitespace
-from utils.regex.apply import regex_apply_on_text, regex_pattern_apply_on_text
-from utils.regex.patterns import get_line_matches_from_text
+from utils.regex.apply import regex_apply_on_text, regex_pattern_apply_on_text, regex_apply_on_text_spans
+from utils.regex.patterns import get_line_matches_from_text, get_line_matches_from_lines
+from utils.text.lines import LineIndex
+from utils.regex.engine import compile_pattern, get_pattern_engine
 import copy
+import bisect
+import gc
+from itertools import islice
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 
 
 class Color(Enum):
@@ -22,39 +29,96 @@ class Alignment(Enum):
     MIDDLE = 3
 
 
+# The class of the first character of the text at a token boundary.
+# Used to dispatch only to the tokens which can possibly start with that character.
+class CharClass(Enum):
+    DIGIT = 1
+    SPACE = 2
+    OTHER = 3
+
+
+def get_char_class(char):
+    if char.isdecimal():
+        return CharClass.DIGIT
+    elif char.isspace():
+        return CharClass.SPACE
+    return CharClass.OTHER
+
+
+CHAR_CLASSES_ALL = (CharClass.DIGIT, CharClass.SPACE, CharClass.OTHER)
+
+
 # wc: wildcard. This means that the pattern_str has to be appended with *, +, {len}, {min,max}
 #               before being added to the regex
 class Token(Enum):
     DATE_YYYY = {"pattern_str": r"\d{2}/\d{2}/\d{4}", "min_len": 10, "max_len": 10, "wildcard": False,
-                 "abbr": "DY4", "hash": "D4"}
+                 "abbr": "DY4", "hash": "D4", "first_chars": (CharClass.DIGIT,)}
     DATE_YY = {"pattern_str": r"\d{2}/\d{2}/\d{2}", "min_len": 8, "max_len": 8, "wildcard": False,
-               "abbr": "DY2", "hash": "D2"}
+               "abbr": "DY2", "hash": "D2", "first_chars": (CharClass.DIGIT,)}
     NUMBER = {"pattern_str": r"(?:\d[,.\d]*)?\d", "min_len": 1, "max_len": None, "wildcard": False,
-              "abbr": "NUM", "hash": "N"}
+              "abbr": "NUM", "hash": "N", "first_chars": (CharClass.DIGIT,)}
     WORD = {"pattern_str": r"\S+", "min_len": 1, "max_len": None, "wildcard": False,
-            "abbr": "WRD", "hash": "W"}
+            "abbr": "WRD", "hash": "W", "first_chars": (CharClass.DIGIT, CharClass.OTHER)}
     # A phrase currently has a minimum of two words
     PHRASE = {"pattern_str": r"\S+(?:\s\S+)+", "min_len": 1, "max_len": None, "wildcard": False,
-              "abbr": "PHR", "hash": "P"}
+              "abbr": "PHR", "hash": "P", "first_chars": (CharClass.DIGIT, CharClass.OTHER)}
     PHRASE_OR_WORD = {"pattern_str": r"\S+(?:\s\S+)*", "min_len": 1, "max_len": None, "wildcard": False,
-                      "abbr": "PHW", "hash": "P"}
+                      "abbr": "PHW", "hash": "P", "first_chars": (CharClass.DIGIT, CharClass.OTHER)}
     WHITESPACE_HORIZONTAL = {"pattern_str": r"[ ]", "min_len": 1, "max_len": None, "wildcard": True,
-                             "abbr": "WSH", "hash": "S"}
+                             "abbr": "WSH", "hash": "S", "first_chars": (CharClass.SPACE,)}
     # WHITESPACE_HORIZONTAL = {"pattern_str": r"[^\S\r\n]", "min_len": 1, "max_len": None, "wildcard": True,
     #                          "abbr": "WSH", "hash": "S"}
     WHITESPACE_ANY = {"pattern_str": r"\s", "min_len": 1, "max_len": None, "wildcard": True,
-                      "abbr": "WSA", "hash": "SA"}
+                      "abbr": "WSA", "hash": "SA", "first_chars": (CharClass.SPACE,)}
     ANY_CHAR = {"pattern_str": r".", "min_len": 1, "max_len": None, "wildcard": True,
-                "abbr": "ANY", "hash": "A"}
+                "abbr": "ANY", "hash": "A", "first_chars": CHAR_CLASSES_ALL}
     # TBD: The CUSTOM token details shall be defined at the time of the definition
     CUSTOM = {"pattern_str": None, "min_len": None, "max_len": None, "wildcard": False,
-              "abbr": None, "hash": None}
+              "abbr": None, "hash": None, "first_chars": CHAR_CLASSES_ALL}
 
     def __str__(self):
-        return self.value["abbr"]
+        return self.kind.abbr
 
     def hash_str(self):
-        return self.value["hash"]
+        return self.kind.hash
+
+    def first_chars(self):
+        return self.kind.first_chars
+
+    # The values are dicts, which makes the default pickling by value a linear lookup on unpickling
+    def __reduce_ex__(self, protocol):
+        return getattr, (self.__class__, self.name)
+
+
+# Flyweight of the attributes of a Token, interned once per Token as Token.kind.
+# The hot paths read these instead of the enum dict values.
+# The code is the small integer used for the token in CompactTokenSequence.
+class TokenKind:
+    __slots__ = ("token", "code", "pattern_str", "min_len", "max_len", "wildcard", "abbr", "hash", "first_chars")
+
+    def __init__(self, token, code):
+        self.token = token
+        self.code = code
+        self.pattern_str = token.value["pattern_str"]
+        self.min_len = token.value["min_len"]
+        self.max_len = token.value["max_len"]
+        self.wildcard = token.value["wildcard"]
+        self.abbr = token.value["abbr"]
+        self.hash = token.value["hash"]
+        self.first_chars = token.value["first_chars"]
+
+
+TOKEN_KINDS = tuple(TokenKind(token, code) for code, token in enumerate(Token))
+for token_kind in TOKEN_KINDS:
+    token_kind.token.kind = token_kind
+
+
+# The word like tokens are interchangeable in RegexTokenSequence.is_similar()
+SIMILAR_TOKEN_FOLD = {
+    Token.WORD: Token.PHRASE_OR_WORD,
+    Token.PHRASE: Token.PHRASE_OR_WORD,
+    Token.PHRASE_OR_WORD: Token.PHRASE_OR_WORD,
+}
 
 
 class CombineOperator(Enum):
@@ -63,11 +127,14 @@ class CombineOperator(Enum):
 
 
 class AbsRegex:
+    __slots__ = ()
+
     def regex_str(self):
         raise RuntimeError("Method has to be specified in subclass")
 
 
-@dataclass
+# The tokens are created for every token of every line, hence slots
+@dataclass(slots=True)
 class RegexToken(AbsRegex):
     components: List = field(init=False)
     operator: CombineOperator = field(init=False)
@@ -115,12 +182,13 @@ class RegexToken(AbsRegex):
         self.token = token
         if token is not None:
             if isinstance(token, Token):
-                self.pattern_str = token.value['pattern_str']
-                if token.value['min_len'] is not None:
-                    self.min_len = token.value['min_len']
-                if token.value['max_len'] is not None:
-                    self.max_len = token.value['max_len']
-                self.wildcard = token.value['wildcard']
+                token_kind = token.kind
+                self.pattern_str = token_kind.pattern_str
+                if token_kind.min_len is not None:
+                    self.min_len = token_kind.min_len
+                if token_kind.max_len is not None:
+                    self.max_len = token_kind.max_len
+                self.wildcard = token_kind.wildcard
             elif isinstance(token, RegexToken):
                 self.pattern_str = token.regex_str()
                 self.min_len = token.min_len
@@ -190,7 +258,7 @@ class RegexToken(AbsRegex):
 
     def set_token(self, token):
         self.token = token
-        self.pattern_str = token.value['pattern_str']
+        self.pattern_str = token.kind.pattern_str
 
     # TBD: Check how should we handle the case where min_len=0 and max_len=0 as well.
     def regex_str(self):
@@ -219,13 +287,44 @@ class RegexToken(AbsRegex):
 
     def token_hash_str(self):
         if self.token is not None:
-            return "{}".format(self.token.hash_str())
+            return "{}".format(self.token.kind.hash)
         else:
             raise RuntimeError("Hash for non-enum tokens has to be supported")
 
     def is_whitespace(self):
         return self.token == Token.WHITESPACE_HORIZONTAL or self.token == Token.WHITESPACE_ANY
 
+    # The character classes the token can start with. Tokens defined by a pattern_str can start with any.
+    def first_chars(self):
+        if isinstance(self.token, Token) and self.pattern_str == self.token.kind.pattern_str:
+            return self.token.kind.first_chars
+        return CHAR_CLASSES_ALL
+
+
+# The whitespace_max_lens are (is_whitespace, max_len) of the tokens.
+# Returns the count of tokens to be removed from the head and the tail.
+def get_trim_counts(whitespace_max_lens, trim_head=True, trim_tail=True,
+                    tail_alignment_tolerance=6, head_alignment_tolerance=4):
+    tail_remove_count = 0
+    if trim_tail:
+        for whitespace, max_len in reversed(whitespace_max_lens):
+            if whitespace:
+                if max_len <= tail_alignment_tolerance:
+                    tail_remove_count += 1
+            else:
+                break
+
+    head_remove_count = 0
+    if trim_head:
+        for whitespace, max_len in whitespace_max_lens:
+            if whitespace:
+                if max_len <= head_alignment_tolerance:
+                    head_remove_count += 1
+            else:
+                break
+
+    return head_remove_count, tail_remove_count
+
 
 @dataclass
 class RegexTokenSequence(AbsRegex):
@@ -233,19 +332,49 @@ class RegexTokenSequence(AbsRegex):
     tokens: List = field(default_factory=list)
     flag_full_line: bool = field(default=False)
 
+    # The regex_str(), token_str(), token_hash_str() and the compiled patterns are cached for a version.
+    # Any change to the tokens has to be followed by touch() to bump the version.
+    version: int = field(init=False, default=0, compare=False, repr=False)
+    cached_version: int = field(init=False, default=0, compare=False, repr=False)
+    cache: Dict = field(init=False, default_factory=dict, compare=False, repr=False)
+    named_token_sequence: Optional["RegexTokenSequence"] = field(init=False, default=None, compare=False, repr=False)
+    named_token_sequence_key: Optional[tuple] = field(init=False, default=None, compare=False, repr=False)
+
     def __str__(self):
         return "\n".join(map(lambda x: str(x), self.tokens))
 
+    def touch(self):
+        self.version += 1
+
+    def get_cached(self, key, create_value):
+        if self.cached_version != self.version:
+            self.cache.clear()
+            self.cached_version = self.version
+
+        if key not in self.cache:
+            self.cache[key] = create_value()
+
+        return self.cache[key]
+
     def push_token(self, token):
         self.tokens.append(token)
+        self.touch()
 
     def pop_token(self):
         self.tokens.pop()
+        self.touch()
 
     def set_full_line(self, flag_full_line):
         self.flag_full_line = flag_full_line
+        self.touch()
 
+    # The named token sequence shares the tokens, hence the tokens of self are named as well.
+    # It is generated again only when self has been modified since.
     def generate_named_token_sequence(self, non_space_tokens=True, space_tokens=False):
+        named_token_sequence_key = (self.version, non_space_tokens, space_tokens)
+        if self.named_token_sequence is not None and self.named_token_sequence_key == named_token_sequence_key:
+            return self.named_token_sequence
+
         self.named_token_sequence = RegexTokenSequence(flag_full_line=self.flag_full_line)
 
         for tkn_idx, regex_token in enumerate(self.tokens):
@@ -260,9 +389,22 @@ class RegexTokenSequence(AbsRegex):
 
             self.named_token_sequence.push_token(regex_token)
 
+        self.touch()
+        self.named_token_sequence_key = (self.version, non_space_tokens, space_tokens)
+
         return self.named_token_sequence
 
     def regex_str(self, newline_between_tokens=False, token_join_str=None):
+        return self.get_cached(("regex_str", newline_between_tokens, token_join_str),
+                               lambda: self.create_regex_str(newline_between_tokens=newline_between_tokens,
+                                                             token_join_str=token_join_str))
+
+    # The compiled pattern of regex_str(), with the engine selected for it unless specified
+    def regex_pattern(self, flags=0, engine=None):
+        return self.get_cached(("regex_pattern", flags, get_pattern_engine(self.regex_str(), engine=engine)),
+                               lambda: compile_pattern(self.regex_str(), flags, engine=engine))
+
+    def create_regex_str(self, newline_between_tokens=False, token_join_str=None):
         join_str = self.default_token_join_str
 
         if newline_between_tokens:
@@ -287,12 +429,10 @@ class RegexTokenSequence(AbsRegex):
         return tokens_regex_str
 
     def token_hash_str(self):
-        tokens_str = "-".join(map(lambda tkn: tkn.token_hash_str(), self.tokens))
-        return tokens_str
+        return self.get_cached("token_hash_str", lambda: "-".join(map(lambda tkn: tkn.token_hash_str(), self.tokens)))
 
     def token_str(self):
-        tokens_str = "".join(map(lambda tkn: tkn.token_str(), self.tokens))
-        return tokens_str
+        return self.get_cached("token_str", lambda: "".join(map(lambda tkn: tkn.token_str(), self.tokens)))
 
     def token_type_len_str(self, fill_char="X", whitespace_char="S", join_str=" ", alignment=3, debug=False):
         buffer = ""
@@ -313,23 +453,11 @@ class RegexTokenSequence(AbsRegex):
                 return regex_token
 
     def trim(self, trim_head=True, trim_tail=True, tail_alignment_tolerance=6, head_alignment_tolerance=4):
-        tail_remove_count = 0
-        if trim_tail:
-            for regex_token in reversed(self.tokens):
-                if regex_token.is_whitespace():
-                    if regex_token.max_len <= tail_alignment_tolerance:
-                        tail_remove_count += 1
-                else:
-                    break
-
-        head_remove_count = 0
-        if trim_head:
-            for regex_token in self.tokens:
-                if regex_token.is_whitespace():
-                    if regex_token.max_len <= head_alignment_tolerance:
-                        head_remove_count += 1
-                else:
-                    break
+        head_remove_count, tail_remove_count = get_trim_counts(
+            list(map(lambda tkn: (tkn.is_whitespace(), tkn.max_len), self.tokens)),
+            trim_head=trim_head, trim_tail=trim_tail,
+            tail_alignment_tolerance=tail_alignment_tolerance, head_alignment_tolerance=head_alignment_tolerance
+        )
 
         size = len(self.tokens)
         trimmed_tokens = self.tokens[head_remove_count:size-tail_remove_count]
@@ -339,6 +467,14 @@ class RegexTokenSequence(AbsRegex):
 
         return trimmed_regex_token_sequence
 
+    # Canonical key for is_similar(): the token kinds of the trimmed sequence with the word like tokens
+    # folded into one class. The whitespace tolerances are accounted for by the trim.
+    # Sequences with different keys are never similar, the converse has to be checked with is_similar().
+    def similar_key(self):
+        return tuple(map(lambda tkn: SIMILAR_TOKEN_FOLD.get(tkn.token, tkn.token) if isinstance(tkn.token, Token)
+                         else Token.CUSTOM,
+                         self.trim().tokens))
+
     def is_similar(self, second_token_sequence, trim=True, debug=False):
         if debug or False:
             print("  Self Tokens:\n{}".format(self.token_str()))
@@ -351,13 +487,22 @@ class RegexTokenSequence(AbsRegex):
             self_trim = self
             second_token_sequence_trim = second_token_sequence
 
+        # The tokens to be widened to PHRASE_OR_WORD are set only when the sequences are similar
+        phrase_or_word_tokens = []
+
+        # The tokens of a CompactTokenSequence are created on access
+        second_trim_tokens = second_token_sequence_trim.tokens
+
+        # The cache of self is invalidated only when its tokens are modified
+        tokens_modified = False
+
         flag_match = True
         for idx, regex_token in enumerate(self_trim.tokens):
-            if idx >= len(second_token_sequence_trim.tokens):
+            if idx >= len(second_trim_tokens):
                 flag_match = False
                 break
 
-            second_regex_token = second_token_sequence_trim.tokens[idx]
+            second_regex_token = second_trim_tokens[idx]
             if regex_token.token != second_regex_token.token:
                 if debug:
                     print("Token mismatch {} and {}".format(regex_token.token, second_regex_token.token))
@@ -365,11 +510,11 @@ class RegexTokenSequence(AbsRegex):
                 flag_match = False
                 if regex_token.token == Token.WORD:
                     if second_regex_token.token == Token.PHRASE:
-                        regex_token.set_token(Token.PHRASE_OR_WORD)
+                        phrase_or_word_tokens.append(regex_token)
                         flag_match = True
                 elif regex_token.token == Token.PHRASE:
                     if second_regex_token.token == Token.WORD:
-                        regex_token.set_token(Token.PHRASE_OR_WORD)
+                        phrase_or_word_tokens.append(regex_token)
                         flag_match = True
                 elif regex_token.token == Token.PHRASE_OR_WORD:
                     if second_regex_token.token == Token.PHRASE:
@@ -385,22 +530,23 @@ class RegexTokenSequence(AbsRegex):
         # prefix match: len(second_token_sequence) > len(self.token_sequence)
         # complete match:
         if flag_match:
-            if len(second_token_sequence_trim.tokens) > len(self_trim.tokens):
+            if len(second_trim_tokens) > len(self_trim.tokens):
                 if debug:
                     print("Prefix Match: Ignored")
                 flag_match = False
-            elif len(second_token_sequence_trim.tokens) == len(self_trim.tokens):
+            elif len(second_trim_tokens) == len(self_trim.tokens):
                 if len(self_trim.tokens) == 0:
                     if debug:
                         print("Blank Match")
                 else:
-                    if len(self.tokens) != len(second_token_sequence.tokens):
+                    second_tokens = second_token_sequence.tokens
+                    if len(self.tokens) != len(second_tokens):
                         if debug:
                             print("Complete Trim Match")
 
                         # TBD: This needs to be corrected. We need to address head_trim as well
-                        if len(second_token_sequence.tokens) > len(self.tokens):
-                            last_token_of_second = second_token_sequence.tokens[-1]
+                        if len(second_tokens) > len(self.tokens):
+                            last_token_of_second = second_tokens[-1]
                             if last_token_of_second.token != Token.WHITESPACE_HORIZONTAL:
                                 print("second_token_sequence {} head_trim correction not supported yet".format(
                                     second_token_sequence.token_str())
@@ -410,13 +556,15 @@ class RegexTokenSequence(AbsRegex):
                                 self.tokens.append(RegexToken(Token.WHITESPACE_HORIZONTAL,
                                                               min_len=0,
                                                               max_len=last_token_of_second.max_len))
+                                tokens_modified = True
                         else:
                             last_token_of_self = self.tokens[-1]
                             if last_token_of_self.token != Token.WHITESPACE_HORIZONTAL:
                                 print("self {} head_trim correction not supported yet".format(self.token_str()))
                                 flag_match = False
-                            else:
+                            elif last_token_of_self.min_len != 0:
                                 last_token_of_self.min_len = 0
+                                tokens_modified = True
                     else:
                         if debug:
                             print("Complete Match")
@@ -424,6 +572,14 @@ class RegexTokenSequence(AbsRegex):
                 # In this case flag_match should be set to false in the above block
                 raise RuntimeError("This should not have happened. Examine logic")
 
+        if flag_match:
+            for regex_token in phrase_or_word_tokens:
+                regex_token.set_token(Token.PHRASE_OR_WORD)
+                tokens_modified = True
+
+        if tokens_modified:
+            self.touch()
+
         return flag_match
 
 
@@ -486,6 +642,62 @@ class FixedRegexTokenSequence(RegexTokenSequence):
 
         return self.shadow_token_sequence
 
+    # A column sequence has only fixed length horizontal whitespace and any char tokens on a full line.
+    # Such a sequence can be matched by slicing the columns of a line instead of a regex.
+    def is_column_sequence(self):
+        if not self.flag_full_line:
+            return False
+
+        for regex_token in self.tokens:
+            if regex_token.token not in (Token.WHITESPACE_HORIZONTAL, Token.ANY_CHAR):
+                return False
+            if regex_token.components is not None or not regex_token.wildcard or \
+                    regex_token.pattern_str != regex_token.token.value['pattern_str']:
+                return False
+            if regex_token.min_len != regex_token.max_len or regex_token.min_len < 0:
+                return False
+
+        return True
+
+    # Returns the (start, end, regex_token) column spans as they would be after adjust_alignment(1) has been
+    # applied adjustment times, without modifying the tokens. Returns None if the adjustment is not possible.
+    def get_column_spans(self, adjustment=0):
+        token_lens = [regex_token.min_len for regex_token in self.tokens]
+
+        for _ in range(adjustment):
+            flag_prev_adjusted = False
+            for tkn_idx, regex_token in enumerate(self.tokens):
+                if flag_prev_adjusted:
+                    if token_lens[tkn_idx] <= 1:
+                        return None
+                    token_lens[tkn_idx] -= 1
+                    flag_prev_adjusted = False
+
+                if regex_token.multiline:
+                    if regex_token.alignment == Alignment.LEFT:
+                        token_lens[tkn_idx] += 1
+                        flag_prev_adjusted = True
+
+        column_spans = []
+        column_start = 0
+        for regex_token, token_len in zip(self.tokens, token_lens):
+            column_spans.append((column_start, column_start + token_len, regex_token))
+            column_start += token_len
+
+        return column_spans
+
+    # Compiles the sequence into a slice based extractor. Returns None if the sequence is not a column sequence
+    # or the adjustment is not possible.
+    def compile_extractor(self, adjustment=0):
+        if not self.is_column_sequence():
+            return None
+
+        column_spans = self.get_column_spans(adjustment)
+        if column_spans is None:
+            return None
+
+        return FixedWidthExtractor.from_column_spans(column_spans)
+
     def adjust_alignment(self, adjustment):
         flag_prev_adjusted = False
         for regex_token in self.tokens:
@@ -502,6 +714,275 @@ class FixedRegexTokenSequence(RegexTokenSequence):
                     regex_token.max_len += adjustment
                     flag_prev_adjusted = True
 
+        self.touch()
+
+
+# Compact and immutable form of a RegexTokenSequence of plain Token tokens, as generated for each line.
+# The tokens are kept as columns of small integers: the TokenKind code, min_len, max_len and flags.
+# Hashing, trimming and the similar key work on the columns. The RegexToken objects are created only on access
+# of tokens, and to_token_sequence() gives a mutable copy.
+@dataclass
+class CompactTokenSequence:
+    FLAG_WILDCARD = 1
+    FLAG_MULTILINE = 2
+
+    codes: array = field(default_factory=lambda: array('B'))
+    min_lens: array = field(default_factory=lambda: array('i'))
+    max_lens: array = field(default_factory=lambda: array('i'))
+    flags: array = field(default_factory=lambda: array('B'))
+    flag_full_line: bool = False
+    default_token_join_str: str = ""
+
+    # Returns None if the token sequence has tokens which cannot be represented
+    @staticmethod
+    def from_token_sequence(token_sequence):
+        if type(token_sequence) is not RegexTokenSequence:
+            return None
+
+        compact_sequence = CompactTokenSequence(flag_full_line=token_sequence.flag_full_line,
+                                                default_token_join_str=token_sequence.default_token_join_str)
+        for regex_token in token_sequence.tokens:
+            if not isinstance(regex_token.token, Token) or regex_token.components is not None or \
+                    regex_token.capture or regex_token.capture_name is not None or \
+                    regex_token.pattern_str != regex_token.token.kind.pattern_str or \
+                    regex_token.alignment != Alignment.LEFT or regex_token.join_str != "\n":
+                return None
+
+            token_flags = 0
+            if regex_token.wildcard:
+                token_flags |= CompactTokenSequence.FLAG_WILDCARD
+            if regex_token.multiline:
+                token_flags |= CompactTokenSequence.FLAG_MULTILINE
+
+            compact_sequence.codes.append(regex_token.token.kind.code)
+            compact_sequence.min_lens.append(regex_token.min_len)
+            compact_sequence.max_lens.append(regex_token.max_len)
+            compact_sequence.flags.append(token_flags)
+
+        return compact_sequence
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __str__(self):
+        return "\n".join(map(lambda x: str(x), self.tokens))
+
+    @property
+    def tokens(self):
+        return tuple(map(self.create_token, range(len(self.codes))))
+
+    def create_token(self, tkn_idx):
+        token_flags = self.flags[tkn_idx]
+        return RegexToken(TOKEN_KINDS[self.codes[tkn_idx]].token,
+                          min_len=self.min_lens[tkn_idx], max_len=self.max_lens[tkn_idx],
+                          wildcard=bool(token_flags & CompactTokenSequence.FLAG_WILDCARD),
+                          multiline=bool(token_flags & CompactTokenSequence.FLAG_MULTILINE))
+
+    def to_token_sequence(self):
+        token_sequence = RegexTokenSequence(default_token_join_str=self.default_token_join_str,
+                                            flag_full_line=self.flag_full_line)
+        token_sequence.tokens = list(self.tokens)
+        return token_sequence
+
+    # The columns are never modified, hence a copy shares them
+    def copy(self):
+        return CompactTokenSequence(self.codes, self.min_lens, self.max_lens, self.flags,
+                                    flag_full_line=self.flag_full_line,
+                                    default_token_join_str=self.default_token_join_str)
+
+    def is_whitespace_code(self, code):
+        return code == Token.WHITESPACE_HORIZONTAL.kind.code or code == Token.WHITESPACE_ANY.kind.code
+
+    def get_trim_range(self, **kwargs):
+        head_remove_count, tail_remove_count = get_trim_counts(
+            list(zip(map(self.is_whitespace_code, self.codes), self.max_lens)), **kwargs
+        )
+        return head_remove_count, len(self.codes) - tail_remove_count
+
+    # Same as RegexTokenSequence.trim(), the trimmed sequence is not a full line sequence
+    def trim(self, **kwargs):
+        trim_start, trim_end = self.get_trim_range(**kwargs)
+        return CompactTokenSequence(self.codes[trim_start:trim_end], self.min_lens[trim_start:trim_end],
+                                    self.max_lens[trim_start:trim_end], self.flags[trim_start:trim_end])
+
+    def similar_key(self):
+        trim_start, trim_end = self.get_trim_range()
+        return tuple(map(lambda code: SIMILAR_TOKEN_FOLD.get(TOKEN_KINDS[code].token, TOKEN_KINDS[code].token),
+                         self.codes[trim_start:trim_end]))
+
+    def token_hash_str(self):
+        return "-".join(map(lambda code: TOKEN_KINDS[code].hash, self.codes))
+
+    def token_str(self):
+        return self.to_token_sequence().token_str()
+
+    def regex_str(self, *args, **kwargs):
+        return self.to_token_sequence().regex_str(*args, **kwargs)
+
+
+# Extracts the groups of a fixed width layout by slicing the columns of the lines.
+# group_spans are the (start, end, name) of the captured columns, whitespace_spans the (start, end) of the
+# columns which have to be blank for a line to be in the layout.
+@dataclass
+class FixedWidthExtractor:
+    line_len: int
+    whitespace_spans: List = field(default_factory=list)
+    group_spans: List = field(default_factory=list)
+
+    @staticmethod
+    def from_column_spans(column_spans):
+        whitespace_spans = []
+        group_spans = []
+        for column_start, column_end, regex_token in column_spans:
+            if regex_token.token == Token.WHITESPACE_HORIZONTAL:
+                if column_end > column_start:
+                    whitespace_spans.append((column_start, column_end))
+            if regex_token.capture:
+                if regex_token.capture_name is not None and regex_token.capture_name != "":
+                    group_name = regex_token.capture_name
+                else:
+                    group_name = str(len(group_spans) + 1)
+                group_spans.append((column_start, column_end, group_name))
+
+        line_len = column_spans[-1][1] if len(column_spans) > 0 else 0
+
+        return FixedWidthExtractor(line_len, whitespace_spans, group_spans)
+
+    def is_match(self, text):
+        if len(text) != self.line_len:
+            return False
+
+        for column_start, column_end in self.whitespace_spans:
+            if text.count(" ", column_start, column_end) != column_end - column_start:
+                return False
+
+        return True
+
+    # Same result format as regex_pattern_apply_on_text()
+    def match(self, text):
+        if not self.is_match(text):
+            return []
+
+        groups = [[text[column_start:column_end], column_start, column_end, group_name]
+                  for column_start, column_end, group_name in self.group_spans]
+
+        return [{"match": [text, 0, self.line_len], "groups": groups}]
+
+    # Returns a dict of group name to value, None if the line is not in the layout
+    def extract(self, text, validate=True):
+        if validate and not self.is_match(text):
+            return None
+
+        return {group_name: text[column_start:column_end] for column_start, column_end, group_name in self.group_spans}
+
+    def extract_lines(self, lines, validate=True):
+        for line in lines:
+            line_object = self.extract(line, validate=validate)
+            if line_object is not None:
+                yield line_object
+
+    # Batch mode: the lines can be a list of str or a numpy array of fixed width str ('U') or bytes ('S').
+    # Returns (columns, row_mask) where columns is a dict of group name to an array of the column values of the
+    # rows selected by row_mask. With validate, the rows not in the layout are left out.
+    def extract_columns(self, lines, validate=True):
+        import numpy as np
+
+        lines_array = np.asarray(lines)
+        if lines_array.dtype.kind not in ('U', 'S'):
+            raise RuntimeError("lines must be str or bytes, got dtype {}".format(lines_array.dtype))
+
+        row_count = lines_array.shape[0]
+        char_kind = lines_array.dtype.kind
+        blank_char = ' ' if char_kind == 'U' else b' '
+
+        if validate:
+            row_mask = np.char.str_len(lines_array) == self.line_len
+
+        # The array items have to be exactly line_len chars wide for the char view
+        lines_array = lines_array.astype("{}{}".format(char_kind, max(self.line_len, 1)))
+        chars = lines_array.view("{}1".format(char_kind)).reshape(row_count, max(self.line_len, 1))
+
+        if validate:
+            for column_start, column_end in self.whitespace_spans:
+                row_mask &= (chars[:, column_start:column_end] == blank_char).all(axis=1)
+            chars = chars[row_mask]
+        else:
+            row_mask = np.ones(row_count, dtype=bool)
+
+        columns = {}
+        for column_start, column_end, group_name in self.group_spans:
+            column_width = column_end - column_start
+            if column_width < 1:
+                columns[group_name] = np.full(chars.shape[0], '' if char_kind == 'U' else b'',
+                                              dtype="{}1".format(char_kind))
+                continue
+
+            column_chars = np.ascontiguousarray(chars[:, column_start:column_end])
+            columns[group_name] = column_chars.view("{}{}".format(char_kind, column_width)).reshape(-1)
+
+        return columns, row_mask
+
+
+# Matches the lines against the shadow token sequence of a matched line, allowing the multiline tokens to be
+# misaligned by up to alignment_tolerance columns. For a column sequence the line is matched with a
+# FixedWidthExtractor, created once for each adjustment. Otherwise a regex is compiled once for each adjustment.
+# The result is in the format of regex_pattern_apply_on_text().
+@dataclass
+class ShadowLineMatcher:
+    shadow_token_sequence: FixedRegexTokenSequence
+    alignment_tolerance: int = 0
+    # Most matched lines are not followed by a shadow line, hence everything is created when first needed
+    column_sequence: Optional[bool] = field(init=False, default=None)
+    # The entries are indexed on adjustment
+    adjusted_extractors: List = field(init=False, default_factory=list)
+    adjusted_patterns: List = field(init=False, default_factory=list)
+    adjusted_sequence: Optional[FixedRegexTokenSequence] = field(init=False, default=None)
+
+    def match(self, text):
+        if self.column_sequence is None:
+            self.column_sequence = self.shadow_token_sequence.is_column_sequence()
+
+        for adjustment in range(0, self.alignment_tolerance + 1):
+            if self.column_sequence:
+                extractor = self.get_adjusted_extractor(adjustment)
+                if extractor is None:
+                    break
+                matches_in_line = extractor.match(text)
+            else:
+                pattern = self.get_adjusted_pattern(adjustment)
+                if pattern is None:
+                    break
+                matches_in_line = regex_pattern_apply_on_text(pattern, text)
+
+            if len(matches_in_line) > 0:
+                return adjustment, matches_in_line
+
+        return 0, []
+
+    def get_adjusted_extractor(self, adjustment):
+        while len(self.adjusted_extractors) <= adjustment:
+            extractor = self.shadow_token_sequence.compile_extractor(len(self.adjusted_extractors))
+            if extractor is None:
+                return None
+            self.adjusted_extractors.append(extractor)
+
+        return self.adjusted_extractors[adjustment]
+
+    def get_adjusted_pattern(self, adjustment):
+        while len(self.adjusted_patterns) <= adjustment:
+            if self.adjusted_sequence is None:
+                self.adjusted_sequence = copy.deepcopy(self.shadow_token_sequence)
+            else:
+                try:
+                    self.adjusted_sequence.adjust_alignment(1)
+                except RuntimeError as e:
+                    print(e)
+                    return None
+
+            self.adjusted_patterns.append(self.adjusted_sequence.regex_pattern())
+
+        return self.adjusted_patterns[adjustment]
+
 
 @dataclass
 class RegexTextProcessor:
@@ -509,32 +990,148 @@ class RegexTextProcessor:
     data: str = field(init=False, default=None)
     status: str = field(init=False, default='NEW')
     all_lines_with_offsets: list = field(default_factory=list, init=False)
+    line_index: Optional[LineIndex] = field(default=None, init=False)
     matched_lines_data: list = field(default_factory=list, init=False)
     matches_with_absolute_offsets: list = field(default_factory=list, init=False)
     frame_objects: list = field(default_factory=list, init=False)
 
     # Our last whitespace token contains the match for \n as well
-    def process(self, whitespace_line_tolerance=0, alignment_tolerance=0, debug=False):
+    # The line index of the data, built once and shared by process() and split_data_into_chunks()
+    def get_line_index(self):
+        if self.line_index is None or self.line_index.text is not self.data:
+            self.line_index = LineIndex(self.data)
+
+        return self.line_index
+
+    # With max_matches the processing stops after the shadow lines of that many matched lines. The lines are
+    # then read lazily and all_lines_with_offsets is not filled.
+    def process(self, whitespace_line_tolerance=0, alignment_tolerance=0, max_matches=None, debug=False):
         if self.data is None:
             raise RuntimeError("get_matches_with_token_mask_builder(): data must be set before calling this function")
 
         # TBD: Can be made as a routine
         # We leave the \n out of the match even though we match the whole line
-        self.all_lines_with_offsets = get_line_matches_from_text(self.data)
+        if max_matches is None:
+            self.all_lines_with_offsets = get_line_matches_from_text(self.data, line_index=self.get_line_index())
+            line_matches = map(lambda line: line['match'], self.all_lines_with_offsets)
+        else:
+            line_matches = self.get_line_index().line_matches()
+
+        matched_lines_data = self.generate_matched_lines_data(line_matches,
+                                                              whitespace_line_tolerance=whitespace_line_tolerance,
+                                                              alignment_tolerance=alignment_tolerance,
+                                                              debug=debug)
+        for matched_line_data in islice(matched_lines_data, max_matches):
+            self.matched_lines_data.append(matched_line_data)
+
+    # Streaming version of process() followed by generate_frame_objects().
+    # The lines can be any iterable of lines e.g. a file handle. Only the current match and its shadow lines are
+    # kept. The frame object of a match is yielded, along with its matches with absolute offsets, as soon as the
+    # shadow lines of the match are closed.
+    # With max_matches the lines are read only till the shadow lines of that many matched lines are closed.
+    def process_stream(self, lines, whitespace_line_tolerance=0, alignment_tolerance=0,
+                       shadow_join_str="", shadow_trim=False, max_matches=None, debug=False):
+        line_matches = get_line_matches_from_lines(lines)
+        matched_lines_data = self.generate_matched_lines_data(line_matches,
+                                                              whitespace_line_tolerance=whitespace_line_tolerance,
+                                                              alignment_tolerance=alignment_tolerance,
+                                                              debug=debug)
+        for matched_line_data in islice(matched_lines_data, max_matches):
+            frame_objects = self.create_frame_objects(matched_line_data,
+                                                      shadow_join_str=shadow_join_str,
+                                                      shadow_trim=shadow_trim)
+
+            line_absolute_offset = matched_line_data['line_match'][1]
+            last_index = len(frame_objects) - 1
+            for index, (frame_object, match_data) in enumerate(zip(frame_objects,
+                                                                    matched_line_data['matches_in_line'])):
+                matches_with_absolute_offsets = [self.convert_absolute_offsets(match_data, line_absolute_offset)]
+                # The shadow lines are combined with the last match in the line
+                if index == last_index:
+                    matches_with_absolute_offsets.extend(self.get_shadow_matches_absolute(matched_line_data))
+
+                yield frame_object, matches_with_absolute_offsets
+
+    # Runs process(), generate_matches_absolute() and generate_frame_objects() on chunks of the data in a
+    # process pool. The chunks are cut only after more than whitespace_line_tolerance blank lines, as the
+    # shadow lines cannot go across these. The results of the chunks are stitched back in order.
+    # The fixed_regex_token_sequence of the matches are costly to send back from the workers, these are left out
+    # of matched_lines_data unless fixed_regex_token_sequences is set.
+    def process_parallel(self, whitespace_line_tolerance=0, alignment_tolerance=0,
+                         shadow_join_str="", shadow_trim=False,
+                         processes=None, chunk_line_count=10000, fixed_regex_token_sequences=False, debug=False):
+        if self.data is None:
+            raise RuntimeError("process_parallel(): data must be set before calling this function")
+
+        chunks = self.split_data_into_chunks(whitespace_line_tolerance=whitespace_line_tolerance,
+                                             chunk_line_count=chunk_line_count)
+        if debug:
+            print("process_parallel(): chunks={}".format(len(chunks)))
+
+        # Unpickling the chunk results creates a lot of containers, the cyclic gc is held back meanwhile
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            chunk_count = len(chunks)
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                chunk_results = executor.map(process_text_chunk,
+                                             [self.regex_token_sequence] * chunk_count,
+                                             [chunk[0] for chunk in chunks],
+                                             [chunk[1] for chunk in chunks],
+                                             [chunk[2] for chunk in chunks],
+                                             [whitespace_line_tolerance] * chunk_count,
+                                             [alignment_tolerance] * chunk_count,
+                                             [shadow_join_str] * chunk_count,
+                                             [shadow_trim] * chunk_count,
+                                             [fixed_regex_token_sequences] * chunk_count)
+
+                for matched_lines_data, matches_with_absolute_offsets, frame_objects in chunk_results:
+                    self.matched_lines_data.extend(matched_lines_data)
+                    self.matches_with_absolute_offsets.extend(matches_with_absolute_offsets)
+                    self.frame_objects.extend(frame_objects)
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    # Returns the chunks as (chunk_text, chunk_start_offset, chunk_start_line_num)
+    def split_data_into_chunks(self, whitespace_line_tolerance=0, chunk_line_count=10000):
+        chunks = []
+
+        chunk_start_offset = 0
+        chunk_start_line_num = 1
+        whitespace_line_count = 0
+        for line_num, line_match in enumerate(self.get_line_index().line_matches(), 1):
+            if not is_whitespace(line_match[0]):
+                whitespace_line_count = 0
+                continue
+
+            whitespace_line_count += 1
+            if whitespace_line_count > whitespace_line_tolerance and \
+                    line_num - chunk_start_line_num + 1 >= chunk_line_count:
+                chunks.append((self.data[chunk_start_offset:line_match[2]], chunk_start_offset, chunk_start_line_num))
+                chunk_start_offset = line_match[2] + 1
+                chunk_start_line_num = line_num + 1
 
-        regex_str = self.regex_token_sequence.regex_str()
-        pattern = re.compile(regex_str)
-        shadow_pattern = None
-        shadow_token_sequence = None
+        if chunk_start_offset <= len(self.data):
+            chunks.append((self.data[chunk_start_offset:], chunk_start_offset, chunk_start_line_num))
+
+        return chunks
+
+    # The line_matches are [line_text, line_start_offset, line_end_offset].
+    # A matched line data is yielded once no more shadow lines can be attached to it.
+    def generate_matched_lines_data(self, line_matches, whitespace_line_tolerance=0, alignment_tolerance=0,
+                                    start_line_num=1, debug=False):
+        pattern = self.regex_token_sequence.regex_pattern()
+        shadow_line_matcher = None
 
         match_count = 0
         whitespace_line_count = 0
         current_matched_line_data = None
 
-        for line_num, line in enumerate(self.all_lines_with_offsets, 1):
-            match_text = line['match'][0]
-            match_start_offset = line['match'][1]
-            match_end_offset = line['match'][2]
+        for line_num, line_match in enumerate(line_matches, start_line_num):
+            match_text = line_match[0]
+            match_start_offset = line_match[1]
+            match_end_offset = line_match[2]
 
             # Line start offset is currently equal to match start offset
             # Line end offset is currently equal to match end offset
@@ -544,7 +1141,10 @@ class RegexTextProcessor:
             if is_whitespace(match_text):
                 whitespace_line_count += 1
                 if whitespace_line_count > whitespace_line_tolerance:
-                    shadow_pattern = None
+                    shadow_line_matcher = None
+                    if current_matched_line_data is not None:
+                        yield current_matched_line_data
+                        current_matched_line_data = None
                 continue
 
             whitespace_line_count = 0
@@ -559,11 +1159,15 @@ class RegexTextProcessor:
 
                 matched_line_data = {
                     'line_num': line_num,
-                    'line_match': line['match'],
+                    'line_match': line_match,
                     'matches_in_line': matches_in_line,
                     'shadow_lines': []
                 }
 
+                # The shadow lines of the previous match are closed
+                if current_matched_line_data is not None:
+                    yield current_matched_line_data
+
                 # We need this to attach the shadow lines data
                 current_matched_line_data = matched_line_data
 
@@ -614,46 +1218,24 @@ class RegexTextProcessor:
                     # Generate the shadow token set so that we can match the following lines
                     line_regex_token_sequence.generate_shadow_token_sequence()
                     if line_regex_token_sequence.shadow_token_sequence is not None:
-                        shadow_regex_str = line_regex_token_sequence.shadow_token_sequence.regex_str()
                         if debug:
+                            shadow_regex_str = line_regex_token_sequence.shadow_token_sequence.regex_str()
                             print("Generated ShadowRegex:{}".format(shadow_regex_str))
-                        shadow_pattern = re.compile(shadow_regex_str)
-                        shadow_token_sequence = line_regex_token_sequence.shadow_token_sequence
-
-                self.matched_lines_data.append(matched_line_data)
+                        shadow_line_matcher = ShadowLineMatcher(line_regex_token_sequence.shadow_token_sequence,
+                                                                alignment_tolerance=alignment_tolerance)
 
                 if debug:
                     print("Token_masks:\n{}".format(token_masks))
-                    print("Fixed Regex:\n{}".format(line['mask_regex']))
+                    print("Fixed Regex:\n{}".format(line_regex_token_sequence.regex_str()))
                     print()
             else:
-                if shadow_pattern is not None:
-                    adjustment = 0
-                    shadow_matches_in_line = regex_pattern_apply_on_text(shadow_pattern, match_text)
-
-                    if len(shadow_matches_in_line) < 1:
-                        if alignment_tolerance > 0 and True:
-
-                            for adjustment in range(1, alignment_tolerance+1):
-                                # print("Shadow  :{}".format(shadow_token_sequence.regex_str()))
-                                try:
-                                    shadow_token_sequence.adjust_alignment(1)
-                                    # print("Adjusted:{}".format(shadow_token_sequence.regex_str()))
-                                    adjusted_shadow_pattern = re.compile(shadow_token_sequence.regex_str())
-                                    shadow_matches_in_line = regex_pattern_apply_on_text(adjusted_shadow_pattern, match_text)
-                                    if len(shadow_matches_in_line) > 0:
-                                        # print("Adjustment={} Found Match: {}".format(adjustment, match_text))
-                                        break
-                                except RuntimeError as e:
-                                    print(e)
-                                    break
-                                    
-                            shadow_token_sequence.adjust_alignment(-adjustment)
+                if shadow_line_matcher is not None:
+                    adjustment, shadow_matches_in_line = shadow_line_matcher.match(match_text)
 
                     if len(shadow_matches_in_line) > 0:
                         shadow_line_data = {
                             'adjustment': adjustment,
-                            'line_match': line['match'],
+                            'line_match': line_match,
                             'matches_in_line': shadow_matches_in_line
                         }
 
@@ -665,6 +1247,9 @@ class RegexTextProcessor:
                         if debug or False:
                             print("{:>3}:{}".format(line_num, match_text))
 
+        if current_matched_line_data is not None:
+            yield current_matched_line_data
+
     def display(self, data_offset=0, data_size=10):
         matched_lines_sample = self.matched_lines_data[data_offset:data_size]
 
@@ -708,7 +1293,6 @@ class RegexTextProcessor:
 
         for line_data in self.matched_lines_data:
             matches_in_line = line_data['matches_in_line']
-            shadow_lines = line_data['shadow_lines']
 
             line_absolute_offset = line_data['line_match'][1]
             # Lines can have multiple matches
@@ -716,42 +1300,61 @@ class RegexTextProcessor:
                 # print(line_data)
                 self.matches_with_absolute_offsets.append(self.convert_absolute_offsets(match_data, line_absolute_offset))
 
-            # There can be multiple shadow lines
-            for shadow_line_data in shadow_lines:
-                # print("{}".format(shadow_line_data))
-                matches_in_line = shadow_line_data["matches_in_line"]
-                shadow_line_absolute_offset = shadow_line_data['line_match'][1]
-                for match_data in matches_in_line:
-                    # print(match_data)
-                    self.matches_with_absolute_offsets.append(self.convert_absolute_offsets(match_data, shadow_line_absolute_offset))
+            self.matches_with_absolute_offsets.extend(self.get_shadow_matches_absolute(line_data))
 
     def generate_frame_objects(self, shadow_join_str="", shadow_trim=False, debug=False):
         if debug:
             print("Generate Frame")
 
         for line_data in self.matched_lines_data:
-            matches_in_line = line_data['matches_in_line']
-            shadow_lines = line_data['shadow_lines']
+            self.frame_objects.extend(self.create_frame_objects(line_data,
+                                                                shadow_join_str=shadow_join_str,
+                                                                shadow_trim=shadow_trim))
 
-            # Lines can have multiple matches
+    @staticmethod
+    def create_frame_objects(line_data, shadow_join_str="", shadow_trim=False):
+        frame_objects = []
+
+        matches_in_line = line_data['matches_in_line']
+        shadow_lines = line_data['shadow_lines']
+
+        # Lines can have multiple matches
+        for match_data in matches_in_line:
+            match_object = {}
+            for group in match_data['groups']:
+                match_object[group[3]] = group[0]
+            frame_objects.append(match_object)
+
+        # There can be multiple shadow lines
+        for shadow_line_data in shadow_lines:
+            matches_in_line = shadow_line_data["matches_in_line"]
             for match_data in matches_in_line:
-                match_object = {}
                 for group in match_data['groups']:
-                    match_object[group[3]] = group[0]
-                self.frame_objects.append(match_object)
+                    # print("Need to add '{}' in '{}'".format(group[0], group[3]))
+                    shadow_group_str = group[0]
+                    # print("shadow_trim:{}".format(shadow_trim))
+                    if shadow_trim:
+                        shadow_group_str = shadow_group_str.strip()
+                        # print("shadow_group_str={}".format(shadow_group_str))
+                    match_object[group[3]] = shadow_join_str.join([match_object[group[3]], shadow_group_str])
 
-            # There can be multiple shadow lines
-            for shadow_line_data in shadow_lines:
-                matches_in_line = shadow_line_data["matches_in_line"]
-                for match_data in matches_in_line:
-                    for group in match_data['groups']:
-                        # print("Need to add '{}' in '{}'".format(group[0], group[3]))
-                        shadow_group_str = group[0]
-                        # print("shadow_trim:{}".format(shadow_trim))
-                        if shadow_trim:
-                            shadow_group_str = shadow_group_str.strip()
-                            # print("shadow_group_str={}".format(shadow_group_str))
-                        match_object[group[3]] = shadow_join_str.join([match_object[group[3]], shadow_group_str])
+        return frame_objects
+
+    @staticmethod
+    def get_shadow_matches_absolute(line_data):
+        shadow_matches_absolute = []
+
+        # There can be multiple shadow lines
+        for shadow_line_data in line_data['shadow_lines']:
+            # print("{}".format(shadow_line_data))
+            matches_in_line = shadow_line_data["matches_in_line"]
+            shadow_line_absolute_offset = shadow_line_data['line_match'][1]
+            for match_data in matches_in_line:
+                # print(match_data)
+                shadow_matches_absolute.append(RegexTextProcessor.convert_absolute_offsets(match_data,
+                                                                                           shadow_line_absolute_offset))
+
+        return shadow_matches_absolute
 
     @staticmethod
     def convert_absolute_offsets(match_data, line_absolute_offset):
@@ -770,40 +1373,123 @@ class RegexTextProcessor:
         return {'match': match_absolute_data, 'groups': groups_absolute_data}
 
 
+# Used by RegexTextProcessor.process_parallel(). Has to be at module level for the process pool.
+def process_text_chunk(regex_token_sequence, chunk_text, chunk_start_offset, chunk_start_line_num,
+                       whitespace_line_tolerance, alignment_tolerance, shadow_join_str, shadow_trim,
+                       fixed_regex_token_sequences=True):
+    regex_processor = RegexTextProcessor(regex_token_sequence)
+
+    line_matches = get_line_matches_from_lines(chunk_text.split("\n"), start_offset=chunk_start_offset)
+    for matched_line_data in regex_processor.generate_matched_lines_data(line_matches,
+                                                                         whitespace_line_tolerance=whitespace_line_tolerance,
+                                                                         alignment_tolerance=alignment_tolerance,
+                                                                         start_line_num=chunk_start_line_num):
+        regex_processor.matched_lines_data.append(matched_line_data)
+
+    regex_processor.generate_matches_absolute()
+    regex_processor.generate_frame_objects(shadow_join_str=shadow_join_str, shadow_trim=shadow_trim)
+
+    if not fixed_regex_token_sequences:
+        for matched_line_data in regex_processor.matched_lines_data:
+            for match_data in matched_line_data['matches_in_line']:
+                del match_data['fixed_regex_token_sequence']
+
+    return (regex_processor.matched_lines_data,
+            regex_processor.matches_with_absolute_offsets,
+            regex_processor.frame_objects)
+
+
+# The dictionary is frozen at construction: the tokens are kept in a tuple and their patterns are
+# precompiled. The patterns are dispatched on the class of the first character so that only the
+# tokens which can start with that character are tried.
 @dataclass
 class RegexDictionary:
-    tokens: List[RegexToken] = field(init=False, default_factory=list)
+    number: bool = False
+    phrase: bool = False
+    tokens: tuple = field(init=False, default=())
+    token_patterns: Dict = field(init=False, default_factory=dict)
+    scanner_patterns: Dict = field(init=False, default_factory=dict)
 
     def __post_init__(self):
-        self.tokens.append(RegexToken(Token.DATE_YYYY))
-        self.tokens.append(RegexToken(Token.DATE_YY))
-        # Disabled for unit testing
-        # self.tokens.append(RegexToken(Token.NUMBER))
-        # Phrases are detected by combining words
-        # self.tokens.append(RegexToken(Token.PHRASE))
-        self.tokens.append(RegexToken(Token.WORD))
-        self.tokens.append(RegexToken(Token.WHITESPACE_HORIZONTAL))
+        tokens = [RegexToken(Token.DATE_YYYY), RegexToken(Token.DATE_YY)]
+        # Disabled by default for unit testing
+        if self.number:
+            tokens.append(RegexToken(Token.NUMBER))
+        # Phrases are detected by combining words, by default
+        if self.phrase:
+            tokens.append(RegexToken(Token.PHRASE))
+        tokens.append(RegexToken(Token.WORD))
+        tokens.append(RegexToken(Token.WHITESPACE_HORIZONTAL))
+
+        self.tokens = tuple(tokens)
+        self.compile_patterns()
+        self.compile_scanner()
 
     def __str__(self):
         return "\n".join(map(lambda x: "{}:{}".format(type(x).__name__, str(x)), self.tokens))
 
-    def token_first(self, text, debug=False):
-        match_count = 0
+    # Anchored pattern per token, in dictionary order, for each first character class
+    def compile_patterns(self):
+        self.token_patterns = {char_class: [] for char_class in CHAR_CLASSES_ALL}
         for token in self.tokens:
-            token_regex_str = "^{}".format(token.regex_str())
+            token_pattern = re.compile("^{}".format(token.regex_str()))
+            for char_class in token.first_chars():
+                self.token_patterns[char_class].append((token, token_pattern))
+
+        return self.token_patterns
+
+    # The scanner is a single alternation of the tokens in dictionary order, for each first character class.
+    # The re alternation is leftmost-first, hence the first alternative matching at pos is the
+    # same token token_first() would have found by trying each token in turn.
+    def compile_scanner(self):
+        self.scanner_patterns = {}
+        for char_class in CHAR_CLASSES_ALL:
+            class_tokens = [token for token, _ in self.token_patterns[char_class]]
+            if len(class_tokens) < 1:
+                self.scanner_patterns[char_class] = (None, {})
+                continue
+
+            scanner_regex_str = "|".join(map(lambda x: "(?P<T{}>{})".format(x[0], x[1].regex_str()),
+                                             enumerate(class_tokens)))
+            scanner_pattern = re.compile(scanner_regex_str)
+            scanner_group_tokens = {}
+            for group_name, group_index in scanner_pattern.groupindex.items():
+                scanner_group_tokens[group_index] = class_tokens[int(group_name[1:])]
+
+            self.scanner_patterns[char_class] = (scanner_pattern, scanner_group_tokens)
+
+        return self.scanner_patterns
+
+    # Returns a lightweight record (token, start, end) of the token found at offset pos of the text
+    def token_scan(self, text, pos=0, debug=False):
+        scanner_pattern, scanner_group_tokens = self.scanner_patterns[get_char_class(text[pos])]
+
+        m = scanner_pattern.match(text, pos) if scanner_pattern is not None else None
+        if m is None:
+            raise RuntimeError("Error! found 0 tokens. need to fix token detection logic to find exactly one")
+
+        token = scanner_group_tokens[m.lastindex]
+
+        if debug:
+            print("token={} token_match={}".format(token, [m.group(), m.start(), m.end()]))
+
+        return token, m.start(), m.end()
+
+    def token_first(self, text, debug=False):
+        token = None
+        m = None
+        for token, token_pattern in self.token_patterns[get_char_class(text[0])]:
             if debug:
-                print("token_regex_str='{}' text='{}'".format(token_regex_str, text))
-            token_pattern = re.compile(token_regex_str)
+                print("token_regex_str='{}' text='{}'".format(token_pattern.pattern, text))
 
-            matches = regex_pattern_apply_on_text(token_pattern, text)
-            match_count = len(matches)
-            if len(matches) > 0:
+            m = token_pattern.match(text)
+            if m is not None:
                 break
 
-        if match_count != 1:
-            raise RuntimeError("Error! found {} tokens. need to fix token detection logic to find exactly one".format(len(matches)))
+        if m is None:
+            raise RuntimeError("Error! found 0 tokens. need to fix token detection logic to find exactly one")
 
-        token_match = matches[0]['match']
+        token_match = [m.group(), m.start(), m.end()]
 
         if debug:
             print("token={} token_match={}".format(token, token_match))
@@ -814,13 +1500,41 @@ class RegexDictionary:
 @dataclass
 class RegexTokenMap:
     token_sequence_map: Dict = field(init=False, default_factory=dict)
+    # similar_key -> [(entry_position, token_hash_key)] sorted on the position of the entry in token_sequence_map
+    similar_index: Dict = field(init=False, default_factory=dict)
+    entry_positions: Dict = field(init=False, default_factory=dict)
+
+    def index_similar_entry(self, token_hash_key):
+        token_map_entry = self.token_sequence_map[token_hash_key]
+        similar_key = token_map_entry['group_token_sequence'].similar_key()
+
+        if token_map_entry.get('similar_key') == similar_key:
+            return
 
+        self.unindex_similar_entry(token_hash_key)
+
+        token_map_entry['similar_key'] = similar_key
+        bisect.insort(self.similar_index.setdefault(similar_key, []),
+                      (self.entry_positions[token_hash_key], token_hash_key))
+
+    def unindex_similar_entry(self, token_hash_key):
+        token_map_entry = self.token_sequence_map.get(token_hash_key)
+        if token_map_entry is None or 'similar_key' not in token_map_entry:
+            return
+
+        bucket = self.similar_index[token_map_entry['similar_key']]
+        bucket.remove((self.entry_positions[token_hash_key], token_hash_key))
+        if len(bucket) < 1:
+            del self.similar_index[token_map_entry['similar_key']]
+
+    # Only the entries with the same similar_key can be similar. These are compared in the order of creation.
     def get_or_create_similar(self, line_item):
         token_hash_key = line_item['token_hash']
         token_sequence = line_item['token_sequence']
 
         flag_match = False
-        for key, token_map_entry in self.token_sequence_map.items():
+        for _, key in self.similar_index.get(token_sequence.similar_key(), []):
+            token_map_entry = self.token_sequence_map[key]
             group_token_sequence = token_map_entry['group_token_sequence']
             try:
                 if group_token_sequence.is_similar(token_sequence):
@@ -843,7 +1557,10 @@ class RegexTokenMap:
         return self.token_sequence_map[token_hash_key]
 
     def create_new_token_map_entry(self, line_item, token_hash_key, debug=False):
-        group_token_sequence = copy.deepcopy(line_item['token_sequence'])
+        if isinstance(line_item['token_sequence'], CompactTokenSequence):
+            group_token_sequence = line_item['token_sequence'].to_token_sequence()
+        else:
+            group_token_sequence = copy.deepcopy(line_item['token_sequence'])
         if debug:
             print("New Entry: LineNum:{} group_token_sequence='{}'".format(line_item['num'], group_token_sequence.token_str()))
 
@@ -851,7 +1568,15 @@ class RegexTokenMap:
         if group_token_sequence.token_str() == '':
             print(group_token_sequence)
 
-        self.token_sequence_map[token_hash_key] = {'group_token_sequence': group_token_sequence, 'line_items': []}
+        # An entry with the same token_hash_key is replaced, it keeps its position in the map
+        self.unindex_similar_entry(token_hash_key)
+        if token_hash_key not in self.entry_positions:
+            self.entry_positions[token_hash_key] = len(self.entry_positions)
+
+        self.token_sequence_map[token_hash_key] = {'group_token_sequence': group_token_sequence, 'line_items': [],
+                                                   'token_hash_key': token_hash_key}
+        self.index_similar_entry(token_hash_key)
+
         return self.token_sequence_map[token_hash_key]
 
     def get_or_create_entry(self, line_item, strategy='exact'):
@@ -864,26 +1589,32 @@ class RegexTokenMap:
 
         group_token_sequence = token_map_entry['group_token_sequence']
         item_token_sequence = line_item['token_sequence']
+        # The tokens of a CompactTokenSequence are created on access
+        item_tokens = item_token_sequence.tokens
 
         try:
             for token_index in range(len(group_token_sequence.tokens)):
                 # This will happen when group_token_sequnce has a tail WS token
-                if token_index >= len(item_token_sequence.tokens):
+                if token_index >= len(item_tokens):
                     group_token = group_token_sequence.tokens[token_index]
                     if group_token.is_whitespace():
                         break
                     else:
                         raise RuntimeError("The token_map_entry {} has an extra token {}".format(token_map_entry, group_token))
 
-                if group_token_sequence.tokens[token_index].min_len > item_token_sequence.tokens[token_index].min_len:
-                    group_token_sequence.tokens[token_index].min_len = item_token_sequence.tokens[token_index].min_len
-                if group_token_sequence.tokens[token_index].max_len < item_token_sequence.tokens[token_index].max_len:
-                    group_token_sequence.tokens[token_index].max_len = item_token_sequence.tokens[token_index].max_len
+                if group_token_sequence.tokens[token_index].min_len > item_tokens[token_index].min_len:
+                    group_token_sequence.tokens[token_index].min_len = item_tokens[token_index].min_len
+                if group_token_sequence.tokens[token_index].max_len < item_tokens[token_index].max_len:
+                    group_token_sequence.tokens[token_index].max_len = item_tokens[token_index].max_len
         except IndexError as e:
             print("IndexError:")
             print("group_token_sequence:{}".format(group_token_sequence.token_str()))
             print(" item_token_sequence:{}".format(item_token_sequence.token_str()))
 
+        # The widening of the tokens changes the regex of the group_token_sequence and can change its trim
+        group_token_sequence.touch()
+        self.index_similar_entry(token_map_entry['token_hash_key'])
+
         return token_map_entry
 
     # TBD: Check how to create an iterator class
@@ -896,6 +1627,11 @@ class RegexGenerator:
     regex_dictionary: RegexDictionary
     regex_colors: [] = field(init=False, default_factory=list)
     phrase_space_tolerance: int = 1
+    # 'scanner': single compiled alternation driven by offsets
+    # 'dictionary': anchored match of each dictionary token on the remaining text (kept for reference)
+    tokenizer: str = 'scanner'
+    # The token sequences of the lines are kept as CompactTokenSequence
+    compact_sequences: bool = True
 
     def __post_init__(self):
         self.regex_colors.append(Color.COLOR1)
@@ -933,16 +1669,26 @@ class RegexGenerator:
             phrase_word_count = 0
 
         while start_offset < text_len:
-            rem_text = text[start_offset:]
+            if self.tokenizer == 'scanner':
+                regex_token, token_start, token_end = self.regex_dictionary.token_scan(text, start_offset)
+                token_match = [text[token_start:token_end], token_start, token_end]
 
-            regex_token, token_match = self.regex_dictionary.token_first(rem_text)
-            # Set the offset from the start of the text
-            token_match[1] += start_offset
-            token_match[2] += start_offset
+                # The dictionary tokens are flat, a shallow copy is enough
+                match_token = copy.copy(regex_token)
+            elif self.tokenizer == 'dictionary':
+                rem_text = text[start_offset:]
+
+                regex_token, token_match = self.regex_dictionary.token_first(rem_text)
+                # Set the offset from the start of the text
+                token_match[1] += start_offset
+                token_match[2] += start_offset
+
+                match_token = copy.deepcopy(regex_token)
+            else:
+                raise RuntimeError("tokenizer '{}' not supported".format(self.tokenizer))
 
             token_match_len = token_match[2] - token_match[1]
 
-            match_token = copy.deepcopy(regex_token)
             match_token.min_len = token_match_len
             match_token.max_len = token_match_len
 
@@ -1059,8 +1805,13 @@ class RegexGenerator:
         for line_num, line_data in enumerate(lines_with_offsets, 1):
             line_text = line_data['match'][0]
             line_token_seq = self.generate_token_sequence_and_verify_regex(line_text, debug=debug)
+            if self.compact_sequences:
+                compact_token_seq = CompactTokenSequence.from_token_sequence(line_token_seq)
+                if compact_token_seq is not None:
+                    line_token_seq = compact_token_seq
 
-            yield {"num": line_num, "text": line_text, 'token_sequence': line_token_seq}
+            yield {"num": line_num, "text": line_text, "offset": line_data['match'][1],
+                   'token_sequence': line_token_seq}
 
     def generate_regex_token_hashes_from_text(self, text, debug=False):
         for line_item in self.generate_regex_token_sequence_per_line_from_text(text, debug=debug):
@@ -1082,23 +1833,26 @@ class RegexGenerator:
 
 # TBD: This could be put under RegexTextProcessor?
 #      Currently this is a global funciton
-def build_token_hashmap(text, build_all=False, extrapolate=False, debug=False):
+# match_scope:
+#   'text': each group regex is applied on the whole text
+#   'lines': each group regex is applied only on the lines assigned to the group.
+#            The lines matched by the regex of another group as well are reported only once, under their own group.
+def build_token_hashmap(text, build_all=False, extrapolate=False, tokenizer='scanner', match_scope='text',
+                        debug=False):
     regex_dictionary = RegexDictionary()
-    regex_generator = RegexGenerator(regex_dictionary)
+    regex_generator = RegexGenerator(regex_dictionary, tokenizer=tokenizer)
 
+    # The token sequences and the hashes of the lines are generated again for the hashmap, only printed here
     if debug:
         print("Regex Token Sequences:")
-    for line_item in regex_generator.generate_regex_token_sequence_per_line_from_text(text, debug=debug):
-        if debug or True:
+        for line_item in regex_generator.generate_regex_token_sequence_per_line_from_text(text, debug=debug):
             print("{}:{}".format(line_item['num'], line_item['token_sequence'].token_str()))
 
-    if debug:
         print("Regex Token Hashes:")
-    for line_item in regex_generator.generate_regex_token_hashes_from_text(text, debug=debug):
-        if debug:
+        for line_item in regex_generator.generate_regex_token_hashes_from_text(text, debug=debug):
             print("{}:{}".format(line_item['num'], line_item['token_hash']))
 
-    if debug or True:
+    if debug:
         print("Regex Token Hashmap:")
     token_hash_map = regex_generator.generate_token_hash_map(text)
 
@@ -1109,7 +1863,15 @@ def build_token_hashmap(text, build_all=False, extrapolate=False, debug=False):
         # group_regex_str = token_hash_matches['group_token_sequence'].regex_str()
         group_regex_str = token_hash_matches['group_token_sequence'].generate_named_token_sequence().regex_str()
 
-        token_hash_regex_match_result = regex_apply_on_text(group_regex_str, text, flags={"multiline": 1})
+        if match_scope == 'text':
+            token_hash_regex_match_result = regex_apply_on_text(group_regex_str, text, flags={"multiline": 1})
+        elif match_scope == 'lines':
+            line_spans = map(lambda item: (item['offset'], item['offset'] + len(item['text'])),
+                             token_hash_matches['line_items'])
+            token_hash_regex_match_result = regex_apply_on_text_spans(group_regex_str, text, line_spans,
+                                                                      flags={"multiline": 1})
+        else:
+            raise RuntimeError("match_scope '{}' not supported".format(match_scope))
         regex_match_count = len(token_hash_regex_match_result['matches'])
 
         token_hash_key_token_count = len(token_hash_matches['group_token_sequence'].tokens)
@@ -1120,7 +1882,7 @@ def build_token_hashmap(text, build_all=False, extrapolate=False, debug=False):
         # TBD: This condition we should be able to send from frontend
         # if "D2" in token_hash_key:
         if build_all or token_hash_key_token_count >= 0:
-            if debug or True:
+            if debug:
                 print("{:<30}[{:>3}]".format("'{}'[{}]".format(token_hash_key, len(token_hash_key)),
                                              token_hash_key_sample_count))
             if debug:
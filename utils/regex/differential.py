@@ -0,0 +1,83 @@
+import re
+from utils.regex.engine import compile_pattern, get_engine_error, get_available_engines, get_match_regs
+from utils.regex.benchmark import generate_statement_text, generate_hdfc_statement_text, generate_contract_note_text, \
+    time_function
+from utils.markers.handlers import get_marker_regexes, get_all_markers
+
+
+def get_all_marker_regexes():
+    return get_marker_regexes(get_all_markers())
+
+
+def get_sample_corpus(line_count=10000, seed=1):
+    return [generate_contract_note_text(line_count, seed=seed),
+            generate_statement_text(line_count, seed=seed),
+            generate_hdfc_statement_text(line_count // 2, seed=seed)]
+
+
+def get_corpus_spans(regex_pattern, corpus):
+    return [[get_match_regs(m, regex_pattern.groups) for m in regex_pattern.finditer(text)] for text in corpus]
+
+
+# Runs the regexes over the corpus with each engine and raises RuntimeError if the spans of an engine differ
+# from those of re. The regexes are multiline by default, as the marker regexes are applied.
+# The regexes an engine cannot compile e.g. the lookarounds with re2 are reported as unsupported.
+def run_differential(regexes=None, corpus=None, engines=None, re_flags=re.MULTILINE, debug=False):
+    if regexes is None:
+        regexes = get_all_marker_regexes()
+
+    if corpus is None:
+        corpus = get_sample_corpus()
+
+    if engines is None:
+        engines = get_available_engines()
+
+    corpus_size = sum(map(len, corpus))
+    results = {engine: {'time': 0.0, 'chars': 0, 'matches': 0, 'unsupported': []} for engine in engines}
+
+    for regex_str in regexes:
+        reference_spans = None
+        for engine in ['re'] + [engine for engine in engines if engine != 're']:
+            try:
+                regex_pattern = compile_pattern(regex_str, re_flags, engine=engine)
+            except get_engine_error(engine) as e:
+                if engine == 're':
+                    raise RuntimeError("regex does not compile with re: {}".format(e))
+                if engine in results:
+                    results[engine]['unsupported'].append(regex_str)
+                if debug:
+                    print("run_differential(): engine '{}' unsupported regex: {}".format(engine, e))
+                continue
+
+            spans, scan_time = time_function(get_corpus_spans, regex_pattern, corpus)
+
+            if reference_spans is None:
+                reference_spans = spans
+            elif spans != reference_spans:
+                raise RuntimeError("engine '{}' spans differ from re for regex:\n{}".format(engine, regex_str))
+
+            if engine in results:
+                results[engine]['time'] += scan_time
+                results[engine]['chars'] += corpus_size
+                results[engine]['matches'] += sum(map(len, spans))
+
+    return results
+
+
+def benchmark_engines(line_count=10000, engines=None, seed=1):
+    regexes = get_all_marker_regexes()
+    results = run_differential(regexes=regexes, corpus=get_sample_corpus(line_count, seed=seed), engines=engines,
+                               re_flags=re.MULTILINE)
+
+    print("Engine Benchmark: regexes={} lines={}".format(len(regexes), line_count))
+    print("  {:<10}{:>10}{:>12}{:>10}{:>14}".format("engine", "time(s)", "MB/s", "matches", "unsupported"))
+    for engine, result in results.items():
+        throughput = result['chars'] / result['time'] / 1e6 if result['time'] > 0 else 0.0
+        print("  {:<10}{:>10.3f}{:>12.2f}{:>10}{:>14}".format(engine, result['time'], throughput,
+                                                              result['matches'], len(result['unsupported'])))
+
+    return results
+
+
+if __name__ == "__main__":
+    benchmark_engines()
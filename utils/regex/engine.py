@@ -0,0 +1,118 @@
+import re
+from typing import Dict
+
+
+# The regex engines:
+# 're': the standard library, the default
+# 'regex': the third party regex module, a superset of re
+# 're2': an RE2 binding with the re like API e.g. google-re2. It runs in linear time, hence it does not
+#        support backreferences and lookarounds, the patterns which use these fail to compile.
+ENGINES = ('re', 'regex', 're2')
+
+# The optional packages of the engines other than re, these are not required by the package
+OPTIONAL_ENGINE_PACKAGES = {
+    'regex': 'regex',
+    're2': 'google-re2',
+}
+
+# Python re comments are not supported by RE2
+INLINE_COMMENT_PATTERN = re.compile(r"\(\?#[^)]*\)")
+INLINE_COMMENT_PATTERN_BYTES = re.compile(rb"\(\?#[^)]*\)")
+
+default_engine = 're'
+# The engine selected per regex_str, overrides the default_engine
+pattern_engines: Dict = {}
+
+
+def get_engine_module(engine=None):
+    if engine is None:
+        engine = default_engine
+
+    if engine == 're':
+        return re
+
+    if engine not in ENGINES:
+        raise RuntimeError("engine '{}' not supported, supported engines are {}".format(engine, ENGINES))
+
+    try:
+        if engine == 'regex':
+            import regex
+            return regex
+        else:
+            import re2
+            return re2
+    except ImportError:
+        raise RuntimeError("engine '{}' is not installed, it needs the optional package '{}'".format(
+            engine, OPTIONAL_ENGINE_PACKAGES[engine]))
+
+
+def is_engine_available(engine):
+    try:
+        get_engine_module(engine)
+    except RuntimeError:
+        return False
+
+    return True
+
+
+def get_available_engines():
+    return [engine for engine in ENGINES if is_engine_available(engine)]
+
+
+def set_default_engine(engine):
+    global default_engine
+
+    get_engine_module(engine)
+    default_engine = engine
+
+
+# Selects the engine for a regex_str, None resets it to the default_engine
+def set_pattern_engine(regex_str, engine):
+    if engine is None:
+        pattern_engines.pop(regex_str, None)
+        return
+
+    get_engine_module(engine)
+    pattern_engines[regex_str] = engine
+
+
+def get_pattern_engine(regex_str, engine=None):
+    if engine is not None:
+        return engine
+
+    return pattern_engines.get(regex_str, default_engine)
+
+
+# The re_flags are the flags of re. The re2 bindings take the flags inline.
+def compile_pattern(regex_str, re_flags=0, engine=None):
+    engine = get_pattern_engine(regex_str, engine=engine)
+    engine_module = get_engine_module(engine)
+
+    if engine == 're2':
+        inline_flags = "".join([flag_char for flag, flag_char in ((re.MULTILINE, "m"), (re.DOTALL, "s"))
+                                if re_flags & flag])
+        if isinstance(regex_str, bytes):
+            regex_str = INLINE_COMMENT_PATTERN_BYTES.sub(b"", regex_str)
+            if inline_flags:
+                regex_str = b"(?" + inline_flags.encode() + b")" + regex_str
+        else:
+            regex_str = INLINE_COMMENT_PATTERN.sub("", regex_str)
+            if inline_flags:
+                regex_str = "(?{}){}".format(inline_flags, regex_str)
+        return engine_module.compile(regex_str)
+
+    return engine_module.compile(regex_str, re_flags)
+
+
+# The error raised by compile_pattern() for an invalid regex_str
+def get_engine_error(engine=None):
+    return get_engine_module(engine).error
+
+
+# The spans of the match followed by the spans of the groups, as the regs of a re match
+def get_match_regs(match, group_count):
+    regs = getattr(match, 'regs', None)
+    if regs is not None:
+        return regs
+
+    return tuple(match.span(index) for index in range(group_count + 1))
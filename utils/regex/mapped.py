@@ -0,0 +1,115 @@
+import mmap
+from array import array
+from dataclasses import dataclass, field
+from utils.exceptions import InvalidParams
+from utils.regex.apply import check_compile_regex, get_group_titles, get_pattern_matches_iter
+from utils.regex.engine import get_match_regs
+
+
+# The continuation bytes of UTF-8 do not start a character
+UTF8_CONTINUATION_BYTES = bytes(range(0x80, 0xC0))
+
+
+# Maps the byte offsets of UTF-8 data to the character offsets of the decoded text.
+# The character offset of a byte is the count of the bytes before it which are not continuation bytes.
+# The counts at the block starts are computed lazily, up to the block of the highest offset asked for.
+# Within a block the count continues from the last offset, hence the offsets are best asked for in order.
+@dataclass
+class ByteCharOffsetMap:
+    data: object
+    block_size: int = 1 << 16
+    block_char_offsets: array = field(init=False, default_factory=lambda: array('q', [0]))
+    last_byte_offset: int = field(init=False, default=0)
+    last_char_offset: int = field(init=False, default=0)
+
+    def count_chars(self, byte_start, byte_end):
+        chunk = self.data[byte_start:byte_end]
+        if chunk.isascii():
+            return len(chunk)
+        return len(chunk.translate(None, UTF8_CONTINUATION_BYTES))
+
+    def fill_block_char_offsets(self, block_index):
+        while len(self.block_char_offsets) <= block_index:
+            block_start = (len(self.block_char_offsets) - 1) * self.block_size
+            self.block_char_offsets.append(self.block_char_offsets[-1] +
+                                           self.count_chars(block_start, block_start + self.block_size))
+
+    def char_offset(self, byte_offset):
+        block_index = byte_offset // self.block_size
+
+        if byte_offset < self.last_byte_offset or block_index != self.last_byte_offset // self.block_size:
+            self.fill_block_char_offsets(block_index)
+            self.last_byte_offset = block_index * self.block_size
+            self.last_char_offset = self.block_char_offsets[block_index]
+
+        self.last_char_offset += self.count_chars(self.last_byte_offset, byte_offset)
+        self.last_byte_offset = byte_offset
+
+        return self.last_char_offset
+
+
+def check_compile_file_regex(regex_str, flags=None, encoding="utf-8"):
+    if encoding.replace("_", "-").lower() not in ("utf-8", "utf8"):
+        raise RuntimeError("encoding '{}' not supported, only utf-8 is supported".format(encoding))
+
+    regex_bytes = regex_str.encode("utf-8") if isinstance(regex_str, str) else regex_str
+    return check_compile_regex(regex_bytes, flags=flags)
+
+
+# The file versions of regex_iter_on_text() and regex_apply_on_text(). The file is memory mapped and only the
+# matches are kept in memory.
+# The regex is compiled as a bytes pattern of the UTF-8 encoded regex_str. The character classes like \s, \d, \w
+# and . then work on single bytes, hence the results are the same as for the decoded text as long as these
+# are used to match ascii text.
+# The offsets are the character offsets of the file decoded as UTF-8 without newline translation.
+def regex_iter_on_file(regex_str, file_path, flags=None, encoding="utf-8", errors="strict", max_matches=None):
+    pattern, regex_error = check_compile_file_regex(regex_str, flags=flags, encoding=encoding)
+
+    if regex_error is not None:
+        raise InvalidParams('Regex Error: ' + regex_error)
+
+    return regex_pattern_iter_on_file(pattern, file_path, errors=errors, max_matches=max_matches)
+
+
+def regex_pattern_iter_on_file(regex_pattern, file_path, errors="strict", max_matches=None):
+    group_titles = get_group_titles(regex_pattern)
+
+    with open(file_path, "rb") as f:
+        # An empty file cannot be mapped
+        if f.seek(0, 2) == 0:
+            return
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            offset_map = ByteCharOffsetMap(mm)
+
+            match_count = 0
+            for m in get_pattern_matches_iter(regex_pattern, mm):
+                # The offsets of a match are mapped in order. The groups which did not match have (-1, -1).
+                byte_offsets = sorted(set(offset for span in get_match_regs(m, regex_pattern.groups) for offset in span if offset >= 0))
+                char_offsets = {byte_offset: offset_map.char_offset(byte_offset) for byte_offset in byte_offsets}
+                char_offsets[-1] = -1
+
+                match_object = [m.group().decode("utf-8", errors), char_offsets[m.start()], char_offsets[m.end()]]
+
+                groups_object = []
+                for index, title in enumerate(group_titles, 1):
+                    group_bytes = m.group(index)
+                    group_start, group_end = m.span(index)
+                    groups_object.append([group_bytes.decode("utf-8", errors) if group_bytes is not None else None,
+                                          char_offsets[group_start], char_offsets[group_end], title])
+
+                yield {"match": match_object, "groups": groups_object}
+
+                match_count += 1
+                if max_matches is not None and match_count >= max_matches:
+                    break
+
+
+def regex_apply_on_file(regex_str, file_path, flags=None, encoding="utf-8", errors="strict"):
+    pattern, regex_error = check_compile_file_regex(regex_str, flags=flags, encoding=encoding)
+
+    matches = []
+    if not regex_error:
+        matches = list(regex_pattern_iter_on_file(pattern, file_path, errors=errors))
+
+    return {"matches": matches, "error": regex_error}
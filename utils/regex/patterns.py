@@ -1,5 +1,5 @@
 import re
-from utils.regex.apply import regex_apply_on_text
+from utils.text.lines import LineIndex
 
 
 # Used to match a valid string in regex comment pattern
@@ -22,9 +22,32 @@ def get_regex_comment_pattern():
     return REGEX_COMMENT_PATTERN
 
 
-def get_line_matches_from_text(text, newline_include=False):
-    line_regex_str = r"^.*$"
+# Same as the matches of the regex ^.*$ (^.*$\n with newline_include) in multiline mode
+def get_line_matches_from_text(text, newline_include=False, line_index=None):
+    return list(iter_line_matches_from_text(text, newline_include=newline_include, line_index=line_index))
+
+
+# Lazy version of get_line_matches_from_text()
+def iter_line_matches_from_text(text, newline_include=False, line_index=None):
+    if line_index is None:
+        line_index = LineIndex(text)
+
+    line_matches = line_index.line_matches()
     if newline_include:
-        line_regex_str = "".join([line_regex_str, r"\n"])
-    result = regex_apply_on_text(line_regex_str, text, flags={"multiline": 1})
-    return result["matches"]
+        # Only the lines followed by a \n
+        line_matches = map(lambda line_match: [text[line_match[1]:line_match[2] + 1], line_match[1], line_match[2] + 1],
+                           line_index.line_matches(end_line_num=len(line_index) - 1))
+
+    return map(lambda line_match: {"match": line_match, "groups": []}, line_matches)
+
+
+# Same as get_line_matches_from_text() for an iterable of lines e.g. a file handle.
+# The lines are assumed to be separated by a single \n, which is left out of the match if present.
+def get_line_matches_from_lines(lines, start_offset=0):
+    line_start_offset = start_offset
+    for line in lines:
+        line_text = line[:-1] if line.endswith("\n") else line
+        line_end_offset = line_start_offset + len(line_text)
+        yield [line_text, line_start_offset, line_end_offset]
+
+        line_start_offset = line_end_offset + 1
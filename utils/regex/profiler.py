@@ -0,0 +1,146 @@
+import json
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict
+
+
+# Statistics of a pattern across the profiled run.
+# The bytes_scanned are the length of the scanned spans, i.e. characters for str patterns.
+# The scans without any match are counted separately, their share of the scan time is the waste ratio.
+@dataclass
+class PatternStats:
+    pattern_str: str
+    flags: int
+    compile_count: int = 0
+    compile_time: float = 0.0
+    scan_count: int = 0
+    scan_time: float = 0.0
+    bytes_scanned: int = 0
+    match_count: int = 0
+    no_match_scan_count: int = 0
+    no_match_scan_time: float = 0.0
+
+    def total_time(self):
+        return self.compile_time + self.scan_time
+
+    def waste_ratio(self):
+        return self.no_match_scan_time / self.scan_time if self.scan_time > 0 else 0.0
+
+    def to_dict(self):
+        return {
+            "pattern": str(self.pattern_str),
+            "flags": self.flags,
+            "compile_count": self.compile_count,
+            "compile_time": self.compile_time,
+            "scan_count": self.scan_count,
+            "scan_time": self.scan_time,
+            "bytes_scanned": self.bytes_scanned,
+            "match_count": self.match_count,
+            "no_match_scan_count": self.no_match_scan_count,
+            "no_match_scan_time": self.no_match_scan_time,
+            "total_time": self.total_time(),
+            "waste_ratio": self.waste_ratio(),
+        }
+
+
+# Opt-in profiler of the compiles and the scans of the regex patterns, keyed on (pattern_str, flags).
+# It is disabled by default, the hooks in utils.regex.apply then cost a single check.
+@dataclass
+class RegexProfiler:
+    enabled: bool = False
+    stats: Dict = field(default_factory=dict)
+
+    def get_stats(self, pattern_str, flags):
+        key = (pattern_str, flags)
+        if key not in self.stats:
+            self.stats[key] = PatternStats(pattern_str, flags)
+        return self.stats[key]
+
+    def record_compile(self, pattern_str, flags, compile_time):
+        pattern_stats = self.get_stats(pattern_str, flags)
+        pattern_stats.compile_count += 1
+        pattern_stats.compile_time += compile_time
+
+    def record_scan(self, regex_pattern, bytes_scanned, scan_time, match_count):
+        pattern_stats = self.get_stats(regex_pattern.pattern, getattr(regex_pattern, 'flags', 0))
+        pattern_stats.scan_count += 1
+        pattern_stats.scan_time += scan_time
+        pattern_stats.bytes_scanned += bytes_scanned
+        pattern_stats.match_count += match_count
+        if match_count == 0:
+            pattern_stats.no_match_scan_count += 1
+            pattern_stats.no_match_scan_time += scan_time
+
+    # Times only the steps of the matches iterator, not the work of the consumer.
+    # The scan is recorded when the iterator is exhausted or closed.
+    def profile_matches(self, regex_pattern, matches_iter, bytes_scanned):
+        scan_time = 0.0
+        match_count = 0
+        try:
+            while True:
+                start_time = time.perf_counter()
+                m = next(matches_iter, None)
+                scan_time += time.perf_counter() - start_time
+
+                if m is None:
+                    break
+
+                match_count += 1
+                yield m
+        finally:
+            self.record_scan(regex_pattern, bytes_scanned, scan_time, match_count)
+
+    def reset(self):
+        self.stats.clear()
+
+    # The stats ranked on the sort_by key of PatternStats.to_dict()
+    def report(self, sort_by="total_time", limit=None):
+        ranked_stats = sorted(map(lambda pattern_stats: pattern_stats.to_dict(), self.stats.values()),
+                              key=lambda pattern_stats: pattern_stats[sort_by], reverse=True)
+        return ranked_stats[:limit]
+
+    def report_json(self, sort_by="total_time", limit=None):
+        return json.dumps(self.report(sort_by=sort_by, limit=limit), indent=2)
+
+    def report_text(self, sort_by="total_time", limit=None, pattern_width=60):
+        header_format = "{:>4} {:<" + str(pattern_width) + "} {:>8} {:>11} {:>11} {:>12} {:>8} {:>6}"
+        row_format = "{:>4} {:<" + str(pattern_width) + "} {:>8} {:>11.3f} {:>11.3f} {:>12} {:>8} {:>6.2f}"
+
+        lines = [header_format.format("Rank", "Pattern", "Scans", "Compile(ms)", "Scan(ms)", "Bytes",
+                                      "Matches", "Waste")]
+        for rank, pattern_stats in enumerate(self.report(sort_by=sort_by, limit=limit), 1):
+            pattern_summary = " ".join(pattern_stats["pattern"].split())
+            if len(pattern_summary) > pattern_width:
+                pattern_summary = "{}...".format(pattern_summary[:pattern_width - 3])
+
+            lines.append(row_format.format(rank, pattern_summary, pattern_stats["scan_count"],
+                                           pattern_stats["compile_time"] * 1000, pattern_stats["scan_time"] * 1000,
+                                           pattern_stats["bytes_scanned"], pattern_stats["match_count"],
+                                           pattern_stats["waste_ratio"]))
+
+        return "\n".join(lines)
+
+    def dump(self, json_file_path=None, text_file_path=None, sort_by="total_time", limit=None):
+        if json_file_path is not None:
+            with open(json_file_path, "w") as f:
+                f.write(self.report_json(sort_by=sort_by, limit=limit))
+
+        if text_file_path is not None:
+            with open(text_file_path, "w") as f:
+                f.write(self.report_text(sort_by=sort_by, limit=limit))
+
+
+regex_profiler = RegexProfiler()
+
+
+# Profiles the regexes applied within the block e.g. a corpus run. The stats are accumulated across blocks
+# till regex_profiler.reset().
+@contextmanager
+def regex_profiling():
+    enabled = regex_profiler.enabled
+    regex_profiler.enabled = True
+    try:
+        yield regex_profiler
+    finally:
+        regex_profiler.enabled = enabled
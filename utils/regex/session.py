@@ -0,0 +1,173 @@
+import threading
+from dataclasses import dataclass, field
+from typing import Optional
+from utils.regex.apply import check_compile_regex, get_group_titles, get_group_offsets, get_pattern_matches_iter
+from utils.text.lines import LineIndex
+
+
+# The lines of a block searched by the count at a time. The cancellation is checked before each block, and the
+# blocks are kept small as a search holds the GIL till it returns.
+COUNT_BLOCK_LINES = 100
+
+
+# The matches of the iterator till the event is set. The event is checked before each search is started.
+def get_matches_till_set(matches_iter, event):
+    while not event.is_set():
+        m = next(matches_iter, None)
+        if m is None:
+            return
+        yield m
+
+
+# An evaluation of a regex in a RegexEvaluationSession.
+# The total count of the matches is computed in a background thread, over blocks of COUNT_BLOCK_LINES lines.
+# The thread stops before its next search once the evaluation is cancelled, hence a superseded count does not
+# run on over the rest of the text. total_count stays None till the count is done, and for a cancelled evaluation.
+@dataclass
+class RegexEvaluation:
+    regex_str: str
+    flags: Optional[dict]
+    generation: int
+    pattern: object = None
+    error: Optional[str] = None
+    total_count: Optional[int] = field(init=False, default=None)
+    cancelled: threading.Event = field(init=False, default_factory=threading.Event)
+    count_done: threading.Event = field(init=False, default_factory=threading.Event)
+    count_thread: Optional[threading.Thread] = field(init=False, default=None)
+
+    # The waiters of the total count are released, with None
+    def cancel(self):
+        self.cancelled.set()
+        self.count_done.set()
+
+    def is_cancelled(self):
+        return self.cancelled.is_set()
+
+    def count_matches(self, text, line_index):
+        match_count = 0
+        line_count = len(line_index)
+        for block_start_line in range(0, line_count, COUNT_BLOCK_LINES):
+            block_end_line = min(block_start_line + COUNT_BLOCK_LINES, line_count)
+            matches_iter = get_pattern_matches_iter(self.pattern, text, line_index.line_starts[block_start_line],
+                                                    line_index.line_ends[block_end_line - 1])
+            match_count += sum(1 for _ in get_matches_till_set(matches_iter, self.cancelled))
+
+        if not self.cancelled.is_set():
+            self.total_count = match_count
+        self.count_done.set()
+
+    def start_count(self, text, line_index):
+        if self.pattern is None:
+            self.total_count = 0
+            self.count_done.set()
+            return
+
+        self.count_thread = threading.Thread(target=self.count_matches, args=(text, line_index), daemon=True)
+        self.count_thread.start()
+
+    # None if the count is not done within the timeout or the evaluation is cancelled
+    def wait_total_count(self, timeout=None):
+        self.count_done.wait(timeout)
+        return self.total_count
+
+
+# Backs the interactive regex editor. The text and its LineIndex stay resident across the evaluations.
+# Each evaluate() supersedes and cancels the previous evaluation, and returns only the matches which start within
+# the lines of the viewport window. The total count is computed in the background, see RegexEvaluation.
+# The window matches are found by scanning the window only, and the count by scanning its blocks only, hence these
+# are the matches of a full scan as long as no match spans the start or the end of the window or of a block
+# e.g. the line anchored marker regexes.
+@dataclass
+class RegexEvaluationSession:
+    text: str
+    max_window_matches: int = 1000
+    line_index: LineIndex = field(init=False)
+    generation: int = field(init=False, default=0)
+    evaluation: Optional[RegexEvaluation] = field(init=False, default=None)
+
+    def __post_init__(self):
+        self.line_index = LineIndex(self.text)
+
+    # The evaluation of the previous text is dropped
+    def set_text(self, text):
+        self.cancel()
+        self.evaluation = None
+        self.text = text
+        self.line_index = LineIndex(text)
+
+    def cancel(self):
+        if self.evaluation is not None:
+            self.evaluation.cancel()
+
+    def get_window_span(self, start_line, end_line):
+        line_count = len(self.line_index)
+        if end_line is None or end_line > line_count:
+            end_line = line_count
+        start_line = min(max(start_line, 0), end_line)
+
+        if start_line >= end_line:
+            return None
+
+        return self.line_index.line_starts[start_line], self.line_index.line_ends[end_line - 1]
+
+    def get_window_matches(self, evaluation, start_line, end_line):
+        matches = []
+
+        window_span = self.get_window_span(start_line, end_line)
+        if window_span is None:
+            return matches
+
+        window_start, window_end = window_span
+        group_titles = get_group_titles(evaluation.pattern)
+
+        matches_iter = get_pattern_matches_iter(evaluation.pattern, self.text, window_start, window_end)
+        for m in get_matches_till_set(matches_iter, evaluation.cancelled):
+            if len(matches) >= self.max_window_matches:
+                break
+
+            match_object = [self.text[m.start():m.end()], m.start(), m.end()]
+            groups_object = get_group_offsets(self.text, m, evaluation.pattern.groupindex, group_titles=group_titles)
+            matches.append({"match": match_object, "groups": groups_object})
+
+        return matches
+
+    def get_result(self, evaluation, start_line, end_line):
+        matches = []
+        if evaluation.error is None:
+            matches = self.get_window_matches(evaluation, start_line, end_line)
+
+        return {
+            "matches": matches,
+            "error": evaluation.error,
+            "generation": evaluation.generation,
+            "window": [start_line, end_line],
+            "total_count": evaluation.total_count,
+            "cancelled": evaluation.is_cancelled()
+        }
+
+    def evaluate(self, regex_str, flags=None, start_line=0, end_line=None):
+        self.cancel()
+
+        self.generation += 1
+        pattern, regex_error = check_compile_regex(regex_str, flags=flags)
+        evaluation = RegexEvaluation(regex_str, flags, self.generation, pattern=pattern, error=regex_error)
+        self.evaluation = evaluation
+
+        # The window matches are found before the count is started, as a search holds the GIL
+        result = self.get_result(evaluation, start_line, end_line)
+        evaluation.start_count(self.text, self.line_index)
+        result["total_count"] = evaluation.total_count
+        return result
+
+    # The matches of the current evaluation within another window e.g. on a scroll
+    def get_window(self, start_line=0, end_line=None):
+        if self.evaluation is None:
+            return None
+
+        return self.get_result(self.evaluation, start_line, end_line)
+
+    def get_total_count(self, timeout=None):
+        if self.evaluation is None:
+            return None
+
+        return self.evaluation.wait_total_count(timeout)
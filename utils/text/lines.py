@@ -1,23 +1,123 @@
 import re
 import copy
+import bisect
+from array import array
+from dataclasses import dataclass, field
 from collections import OrderedDict
 
 
-def get_text_shape(text):
+NEWLINE_PATTERN = re.compile("\n")
+# The line boundaries of str.splitlines()
+UNIVERSAL_NEWLINE_PATTERN = re.compile("\r\n|[\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]")
+
+
+# The start and end offsets of the lines of a text, to be built once per text and shared.
+# By default the lines are split on \n as the regex ^.*$ in multiline mode does i.e. text.split("\n").
+# With universal_newlines the lines are split as text.splitlines() does.
+# The line_num in the methods starts from 0.
+@dataclass
+class LineIndex:
+    text: str
+    universal_newlines: bool = False
+    line_starts: array = field(init=False, default_factory=lambda: array('q'))
+    line_ends: array = field(init=False, default_factory=lambda: array('q'))
+
+    def __post_init__(self):
+        newline_pattern = UNIVERSAL_NEWLINE_PATTERN if self.universal_newlines else NEWLINE_PATTERN
+
+        line_start = 0
+        for m in newline_pattern.finditer(self.text):
+            self.line_starts.append(line_start)
+            self.line_ends.append(m.start())
+            line_start = m.end()
+
+        # As with splitlines() there is no empty line after the last line boundary
+        if not self.universal_newlines or line_start < len(self.text):
+            self.line_starts.append(line_start)
+            self.line_ends.append(len(self.text))
+
+    def __len__(self):
+        return len(self.line_starts)
+
+    def line_span(self, line_num):
+        return self.line_starts[line_num], self.line_ends[line_num]
+
+    def line(self, line_num):
+        return self.text[self.line_starts[line_num]:self.line_ends[line_num]]
+
+    def lines(self):
+        return map(self.line, range(len(self)))
+
+    def line_lengths(self):
+        return map(lambda line_span: line_span[1] - line_span[0], zip(self.line_starts, self.line_ends))
+
+    # The line matches as [line, line_start_offset, line_end_offset]
+    def line_matches(self, start_line_num=0, end_line_num=None):
+        if end_line_num is None:
+            end_line_num = len(self)
+
+        for line_num in range(start_line_num, end_line_num):
+            line_start, line_end = self.line_starts[line_num], self.line_ends[line_num]
+            yield [self.text[line_start:line_end], line_start, line_end]
+
+    # The line containing the offset. An offset at the start of a line belongs to that line, and the offset of a
+    # line boundary e.g. of the \n belongs to the line before it.
+    def offset_to_line(self, offset):
+        return max(bisect.bisect_right(self.line_starts, offset) - 1, 0)
+
+    def offset_to_line_col(self, offset):
+        line_num = self.offset_to_line(offset)
+        return line_num, offset - self.line_starts[line_num]
+
+    # Vectorised offset_to_line() for a sequence of offsets, returns a numpy array
+    def offsets_to_lines(self, offsets):
+        import numpy as np
+
+        line_starts = np.frombuffer(self.line_starts, dtype=np.int64)
+        return np.maximum(np.searchsorted(line_starts, np.asarray(offsets), side='right') - 1, 0)
+
+    # The (line_start, line_end) of the parts of the lines within the span (start, end), as the lines of
+    # text[start:end].split("\n") would be
+    def line_spans_in(self, start, end):
+        for line_num in range(self.offset_to_line(start), self.offset_to_line(end) + 1):
+            yield max(self.line_starts[line_num], start), min(self.line_ends[line_num], end)
+
+
+# The functions below split the lines as text.splitlines() does, hence a line_index passed to them has to be
+# built with universal_newlines
+def check_splitlines_index(line_index):
+    if line_index is not None and not line_index.universal_newlines:
+        raise RuntimeError("line_index has to be built with universal_newlines=True to split as splitlines()")
+
+
+def get_text_shape(text, line_index=None):
+    check_splitlines_index(line_index)
+
     text_shape = {"lines": OrderedDict()}
-    lines = text.splitlines()
-    for index, line in enumerate(lines):
-        text_shape["lines"][index] = len(line)
+    if line_index is None:
+        lines = text.splitlines()
+        line_lengths = map(len, lines)
+        line_count = len(lines)
+    else:
+        line_lengths = line_index.line_lengths()
+        line_count = len(line_index)
+
+    for index, line_length in enumerate(line_lengths):
+        text_shape["lines"][index] = line_length
 
-    text_shape["count"] = len(lines)
+    text_shape["count"] = line_count
 
     return text_shape
 
 
 # Given a string buffer return the max line length
-def get_max_line_length(text):
+def get_max_line_length(text, line_index=None):
+    check_splitlines_index(line_index)
+
     max_len = 0
-    if text is not None:
+    if line_index is not None:
+        max_len = max(line_index.line_lengths(), default=0)
+    elif text is not None:
         for line in text.splitlines():
             line_len = len(line)
             if line_len > max_len:
@@ -26,13 +126,13 @@ def get_max_line_length(text):
     return max_len
 
 
-def pad_lines(text, length, padding_char=' ', join_char="\n"):
-    buffer = ""
-    for line in text.splitlines():
-        padded_line = line.ljust(length, padding_char)
-        buffer = join_char.join([buffer, padded_line])
+def pad_lines(text, length, padding_char=' ', join_char="\n", line_index=None):
+    check_splitlines_index(line_index)
 
-    return buffer
+    lines = text.splitlines() if line_index is None else line_index.lines()
+
+    # The buffer starts with a join_char as the lines are joined to an empty buffer
+    return "".join(join_char + line.ljust(length, padding_char) for line in lines)
 
 
 def is_whitespace(inp_str):
@@ -86,32 +186,29 @@ def get_multiline_post_para_offsets(matches, end_offset):
 
 def get_matches_with_group_relative_offsets(input_str, matches_with_para,
                                             ignore_post_first=True,
-                                            blank_line_threshold=1):
+                                            blank_line_threshold=1,
+                                            line_index=None):
     matches_with_post_groups = copy.deepcopy(matches_with_para)
 
+    if line_index is None:
+        line_index = LineIndex(input_str)
+
     for m_idx,m in enumerate(matches_with_post_groups):
         # print(m)
         groups = m['groups']
         # print(groups)
 
         post_para_offsets = m['post_para']
-        buffer_start_offset_for_post_para = post_para_offsets[0]
-        post_para_str = input_str[buffer_start_offset_for_post_para:post_para_offsets[1]]
-
-        # Necessary to avoid circular import
-        from utils.regex.apply import regex_apply_on_text
 
-        # We should not put \n in the pattern as the last line in buffer might not be having one
-        line_matches = regex_apply_on_text("^.*$", post_para_str, flags={'multiline': True})['matches']
+        # The lines of the post para are the parts of the lines of the text within it
+        line_spans = line_index.line_spans_in(post_para_offsets[0], post_para_offsets[1])
 
         m['post_groups_list'] = []
 
         # Skip the first line and then carve the strings out of the second line onwards
         blank_lines_count = 0
-        for index, line_match in enumerate(line_matches):
-            line = line_match['match'][0]
-            post_para_start_offset_for_line = line_match['match'][1]
-            buffer_start_offset_for_line = post_para_start_offset_for_line + buffer_start_offset_for_post_para
+        for index, (buffer_start_offset_for_line, buffer_end_offset_for_line) in enumerate(line_spans):
+            line = input_str[buffer_start_offset_for_line:buffer_end_offset_for_line]
 
             # We assume the first line is remaining part of the matched line
             if ignore_post_first and index == 0:
@@ -218,6 +315,135 @@ def combine_matches_with_post_groups(matches, join_str="\n", shadow_trim=False,
     return matches_combined
 
 
+def is_multiline_group_name(g_name):
+    g_name_parts = g_name.split("__")
+    return len(g_name_parts) > 1 and g_name_parts[1].upper() == "M"
+
+
+# Single pass version of get_multiline_post_para_offsets() and get_matches_with_group_relative_offsets().
+# Yields (m, post_para, post_lines) for each match, where post_lines are the (line, line_start_offset) of the
+# lines of the post para which carry the multiline groups. The lines are found with str.find() and the walk stops
+# once the blank lines exceed the threshold, rather than splitting the whole post para.
+def generate_matches_with_post_lines(input_str, matches, end_offset=None, ignore_post_first=True,
+                                     blank_line_threshold=1):
+    if end_offset is None:
+        end_offset = len(input_str)
+
+    matches = matches if isinstance(matches, list) else list(matches)
+    multiline_groups_map = {}
+
+    for m_idx, m in enumerate(matches):
+        post_para_start = m['match'][2]
+        post_para_end = matches[m_idx + 1]['match'][1] if m_idx + 1 < len(matches) else end_offset
+        post_para = (post_para_start, post_para_end)
+
+        group_titles = tuple(g[3] for g in m['groups'])
+        if group_titles not in multiline_groups_map:
+            multiline_groups_map[group_titles] = any(map(is_multiline_group_name, group_titles))
+
+        post_lines = []
+        if multiline_groups_map[group_titles]:
+            blank_lines_count = 0
+            line_start_offset = post_para_start
+            line_index = 0
+            while True:
+                newline_offset = input_str.find("\n", line_start_offset, post_para_end)
+                line_end_offset = newline_offset if newline_offset >= 0 else post_para_end
+                line = input_str[line_start_offset:line_end_offset]
+
+                # We assume the first line is remaining part of the matched line
+                if not (ignore_post_first and line_index == 0):
+                    # Same as is_whitespace()
+                    if not line or line.isspace():
+                        blank_lines_count += 1
+                        if blank_lines_count > blank_line_threshold:
+                            break
+                    else:
+                        blank_lines_count = 0
+                        post_lines.append((line, line_start_offset))
+
+                if newline_offset < 0:
+                    break
+                line_start_offset = newline_offset + 1
+                line_index += 1
+
+        yield m, post_para, post_lines
+
+
+# Same result as get_multiline_post_para_offsets(), get_matches_with_group_relative_offsets(),
+# extend_match_groups_with_post_groups() and set_groups_absolute_offset() applied in order.
+# The offsets are computed arithmetically in a single pass without the intermediate copies.
+def get_matches_with_extended_groups_absolute(input_str, matches, end_offset=None, ignore_post_first=True,
+                                              blank_line_threshold=1):
+    matches_absolute = []
+
+    for m, post_para, post_lines in generate_matches_with_post_lines(input_str, matches, end_offset=end_offset,
+                                                                      ignore_post_first=ignore_post_first,
+                                                                      blank_line_threshold=blank_line_threshold):
+        full_match_start = m['match'][1]
+
+        groups = [[g[0], g[1], g[2], g[3], full_match_start, full_match_start] for g in m['groups']]
+        multiline_groups = [g for g in m['groups'] if is_multiline_group_name(g[3])]
+
+        post_groups_list = []
+        for line, line_start_offset in post_lines:
+            post_groups = []
+            for g in multiline_groups:
+                g_start = g[1] - full_match_start
+                g_end = g[2] - full_match_start
+                post_groups.append([line[g_start:g_end], g_start + line_start_offset, g_end + line_start_offset, g[3],
+                                    full_match_start, line_start_offset])
+            post_groups_list.append(post_groups)
+            # As with extend_match_groups_with_post_groups() the post groups are the same objects in both
+            groups.extend(post_groups)
+
+        matches_absolute.append({'match': list(m['match']), 'groups': groups, 'post_para': post_para,
+                                 'post_groups_list': post_groups_list})
+
+    return matches_absolute
+
+
+# Same result as get_multiline_post_para_offsets(), get_matches_with_group_relative_offsets() and
+# combine_matches_with_post_groups() applied in order, in a single pass.
+def get_combined_matches_with_post_groups(input_str, matches, end_offset=None, join_str="\n", shadow_trim=False,
+                                          ignore_post_first=True, blank_line_threshold=1, debug=False):
+    matches_combined = []
+
+    for m, post_para, post_lines in generate_matches_with_post_lines(input_str, matches, end_offset=end_offset,
+                                                                      ignore_post_first=ignore_post_first,
+                                                                      blank_line_threshold=blank_line_threshold):
+        full_match_start = m['match'][1]
+        m_combined = {'groups': []}
+
+        groups_map = {}
+        for g in m['groups']:
+            c_group = {'text': g[0], 'name': g[3], 'offsets_list': [[g[1] - full_match_start, g[2] - full_match_start]]}
+            m_combined['groups'].append(c_group)
+            groups_map[c_group['name']] = c_group
+
+        multiline_groups = [g for g in m['groups'] if is_multiline_group_name(g[3])]
+        for line, line_start_offset in post_lines:
+            for g in multiline_groups:
+                c_group = groups_map[g[3]]
+                g_start = g[1] - full_match_start
+                g_end = g[2] - full_match_start
+                shadow_group_str = line[g_start:g_end]
+
+                if not shadow_group_str or shadow_group_str.isspace():
+                    if debug:
+                        print("Ignored:post group for '{}' is blank".format(c_group['name']))
+                else:
+                    if shadow_trim:
+                        shadow_group_str = shadow_group_str.strip()
+
+                    c_group['text'] = join_str.join([c_group['text'], shadow_group_str])
+                    c_group['offsets_list'].append([g_start, g_end])
+
+        matches_combined.append(m_combined)
+
+    return matches_combined
+
+
 def print_combined_matches(matches):
     for m_idx,m in enumerate(matches):
         print("match[{}]".format(m_idx))